@@ -0,0 +1,140 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from functools import cache
+
+from openpilot.system.hardware.hw import Paths
+
+DEFAULT_CACHE_SIZE_MB = 20 * 1024
+PACK_SIZE = 256 * 1024 * 1024
+
+
+class DownloadCache:
+  """Downloaded blobs packed into large append-only files, located with a sqlite index.
+  Whole packs are evicted least recently used first once the blobs exceed max_bytes."""
+  def __init__(self, root: str, max_bytes: int, pack_size: int = PACK_SIZE):
+    self.root = root
+    self.max_bytes = max_bytes
+    self.pack_size = pack_size
+    self.stats = {"hits": 0, "misses": 0, "read_bytes": 0, "written_bytes": 0, "evictions": 0, "evicted_bytes": 0}
+    self._db_path = os.path.join(root, "index.db")
+    self._lock = threading.Lock()
+    self._pid: int | None = None
+    self._db: sqlite3.Connection | None = None
+
+  def _conn(self) -> sqlite3.Connection:
+    # reconnect in forked children and when the cache dir was removed underneath us
+    if self._db is None or self._pid != os.getpid() or not os.path.exists(self._db_path):
+      os.makedirs(self.root, exist_ok=True)
+      self._pid = os.getpid()
+      self._db = sqlite3.connect(self._db_path, timeout=60, check_same_thread=False, isolation_level=None)
+      self._db.execute("PRAGMA journal_mode=WAL")
+      self._db.execute("PRAGMA synchronous=NORMAL")
+      self._db.execute("CREATE TABLE IF NOT EXISTS blobs (key TEXT PRIMARY KEY, pack TEXT NOT NULL, offset INTEGER NOT NULL, " +
+                       "size INTEGER NOT NULL, last_used REAL NOT NULL)")
+      self._db.execute("CREATE INDEX IF NOT EXISTS blobs_pack ON blobs (pack)")
+      self._read_fds: dict[str, int] = {}
+      # pack this process appends to, never shared with other processes
+      self._pack: str | None = None
+      self._pack_fd = -1
+      self._pack_size = 0
+    return self._db
+
+  def _pack_path(self, pack: str) -> str:
+    return os.path.join(self.root, pack)
+
+  def readinto(self, key: str, out, offset: int = 0) -> int | None:
+    """Copies the blob from offset into out, returns the number of bytes copied or None if key isn't cached."""
+    with self._lock:
+      db = self._conn()
+      row = db.execute("SELECT pack, offset, size FROM blobs WHERE key = ?", (key,)).fetchone()
+      if row is not None:
+        pack, pack_offset, size = row
+        try:
+          if pack not in self._read_fds:
+            self._read_fds[pack] = os.open(self._pack_path(pack), os.O_RDONLY)
+        except FileNotFoundError:
+          # pack evicted by another process
+          db.execute("DELETE FROM blobs WHERE pack = ?", (pack,))
+          row = None
+
+      if row is None:
+        self.stats["misses"] += 1
+        return None
+
+      out = memoryview(out).cast('B')[:max(0, size - offset)]
+      n = os.preadv(self._read_fds[pack], [out], pack_offset + offset) if len(out) else 0
+      # wall clock, last use is compared across processes and reboots
+      db.execute("UPDATE blobs SET last_used = ? WHERE key = ?", (time.time(), key))  # noqa: TID251
+      self.stats["hits"] += 1
+      self.stats["read_bytes"] += n
+      return n
+
+  def get(self, key: str) -> bytes | None:
+    with self._lock:
+      row = self._conn().execute("SELECT size FROM blobs WHERE key = ?", (key,)).fetchone()
+    buf = bytearray(row[0] if row is not None else 0)
+    n = self.readinto(key, buf)
+    return None if n is None else bytes(buf[:n])
+
+  def put(self, key: str, data) -> None:
+    data = memoryview(data).cast('B')
+    with self._lock:
+      db = self._conn()
+      if self._pack is None or (self._pack_size > 0 and self._pack_size + len(data) > self.pack_size):
+        if self._pack_fd != -1:
+          os.close(self._pack_fd)
+        self._pack = f"pack_{uuid.uuid4().hex}"
+        self._pack_fd = os.open(self._pack_path(self._pack), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        self._pack_size = 0
+
+      offset, written = self._pack_size, 0
+      while written < len(data):
+        written += os.pwrite(self._pack_fd, data[written:], offset + written)
+      self._pack_size += len(data)
+
+      # the data is visible to other processes before its index entry
+      db.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?)", (key, self._pack, offset, len(data), time.time()))  # noqa: TID251
+      self.stats["written_bytes"] += len(data)
+      self._evict(db)
+
+  def __contains__(self, key: str) -> bool:
+    with self._lock:
+      return self._conn().execute("SELECT 1 FROM blobs WHERE key = ?", (key,)).fetchone() is not None
+
+  def _evict(self, db: sqlite3.Connection) -> None:
+    total = db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+    if total <= self.max_bytes:
+      return
+
+    packs = db.execute("SELECT pack, SUM(size) FROM blobs GROUP BY pack ORDER BY MAX(last_used)").fetchall()
+    for pack, size in packs:
+      if total <= self.max_bytes:
+        break
+      if pack == self._pack:
+        continue
+
+      db.execute("DELETE FROM blobs WHERE pack = ?", (pack,))
+      fd = self._read_fds.pop(pack, None)
+      if fd is not None:
+        os.close(fd)
+      try:
+        os.remove(self._pack_path(pack))
+      except FileNotFoundError:
+        pass
+      total -= size
+      self.stats["evictions"] += 1
+      self.stats["evicted_bytes"] += size
+
+
+@cache
+def _get_cache(root: str, max_bytes: int) -> DownloadCache:
+  return DownloadCache(root, max_bytes)
+
+
+def get_download_cache() -> DownloadCache:
+  """Returns the shared download cache in Paths.download_cache_root(), its size is set with DOWNLOAD_CACHE_SIZE_MB."""
+  max_bytes = int(os.getenv("DOWNLOAD_CACHE_SIZE_MB", str(DEFAULT_CACHE_SIZE_MB))) * 1024 * 1024
+  return _get_cache(os.path.join(Paths.download_cache_root(), "packs"), max_bytes)
@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+
+from openpilot.common.download_cache import DownloadCache
+
+
+class TestDownloadCache:
+  def setup_method(self):
+    self.root = tempfile.mkdtemp()
+
+  def teardown_method(self):
+    shutil.rmtree(self.root, ignore_errors=True)
+
+  def test_put_get(self):
+    cache = DownloadCache(self.root, max_bytes=1024 * 1024)
+    assert cache.get("a") is None
+    cache.put("a", b"hello")
+    cache.put("b", b"world!")
+    assert cache.get("a") == b"hello"
+    assert cache.get("b") == b"world!"
+    assert "a" in cache and "c" not in cache
+
+    buf = bytearray(3)
+    assert cache.readinto("b", buf, offset=2) == 3
+    assert buf == b"rld"
+
+    # visible to other instances, e.g. other processes
+    assert DownloadCache(self.root, max_bytes=1024 * 1024).get("b") == b"world!"
+    assert cache.stats["hits"] == 3
+    assert cache.stats["misses"] == 1
+    assert cache.stats["written_bytes"] == 11
+
+  def test_eviction(self):
+    cache = DownloadCache(self.root, max_bytes=3000, pack_size=1000)
+    for i in range(10):
+      cache.put(str(i), bytes([i]) * 500)
+      # keep the first pack in use
+      assert cache.get("0") is not None
+
+    assert cache.get("0") == bytes(500)
+    assert cache.get("9") == bytes([9]) * 500
+    assert cache.get("2") is None
+    assert cache.stats["evictions"] > 0
+    assert len([f for f in os.listdir(self.root) if f.startswith("pack_")]) <= 4
+
+  def test_removed_root(self):
+    cache = DownloadCache(self.root, max_bytes=1024 * 1024)
+    cache.put("a", b"hello")
+    shutil.rmtree(self.root)
+
+    assert cache.get("a") is None
+    cache.put("a", b"hello")
+    assert cache.get("a") == b"hello"
@@ -1,2 +1,2 @@
 from openpilot.selfdrive.test.process_replay.process_replay import CONFIGS, get_process_config, get_custom_params_from_lr, \
-                                                                  replay_process, replay_process_with_name  # noqa: F401
+                                                                  replay_process, replay_process_with_name, ReplayWorker  # noqa: F401
@@ -4,6 +4,7 @@ import math
 import capnp
 import numbers
 import dictdiffer
+import numpy as np
 from collections import Counter
 
 from openpilot.tools.lib.logreader import LogReader
@@ -39,6 +40,76 @@ def remove_ignored_fields(msg, ignore):
   return msg
 
 
+def _struct_fields(msg) -> list[str]:
+  fields = list(msg.schema.non_union_fields)
+  if len(msg.schema.union_fields):
+    fields.append(msg.which())
+  return fields
+
+
+def _values_differ(a, b, tolerance: float) -> bool:
+  if a == b:
+    return False
+  if isinstance(a, (int, float)) and isinstance(b, (int, float)) and math.isfinite(a) and math.isfinite(b):
+    return abs(a - b) > max(tolerance, tolerance * max(abs(a), abs(b)))
+  return True
+
+
+def _lists_differ(a, b, tolerance, ignore, path) -> bool:
+  if len(a) != len(b):
+    return True
+  if len(a) == 0:
+    return False
+
+  first = a[0]
+  if isinstance(first, capnp.lib.capnp._DynamicStructReader):
+    return any(_structs_differ(x, y, tolerance, ignore, f"{path}.{i}") for i, (x, y) in enumerate(zip(a, b, strict=True)))
+  if isinstance(first, capnp.lib.capnp._DynamicListReader):
+    return any(_lists_differ(x, y, tolerance, ignore, f"{path}.{i}") for i, (x, y) in enumerate(zip(a, b, strict=True)))
+
+  a, b = list(a), list(b)
+  if a == b:
+    return False
+  if isinstance(first, float):
+    x, y = np.array(a, dtype=np.float64), np.array(b, dtype=np.float64)
+    with np.errstate(invalid='ignore', over='ignore'):
+      close = (x == y) | (np.isfinite(x) & np.isfinite(y) & (np.abs(x - y) <= np.maximum(tolerance, tolerance * np.maximum(np.abs(x), np.abs(y)))))
+    return not bool(close.all())
+  # ints are compared exactly in python, floats can't hold all 64 bit ints
+  return any(_values_differ(x, y, tolerance) for x, y in zip(a, b, strict=True))
+
+
+def _structs_differ(a, b, tolerance, ignore, path="") -> bool:
+  fields = _struct_fields(a)
+  if fields != _struct_fields(b):
+    return True
+
+  for field in fields:
+    field_path = f"{path}.{field}" if path else field
+    if field_path in ignore:
+      continue
+
+    x, y = getattr(a, field), getattr(b, field)
+    if isinstance(x, capnp.lib.capnp._DynamicStructReader):
+      differ = _structs_differ(x, y, tolerance, ignore, field_path)
+    elif isinstance(x, capnp.lib.capnp._DynamicListReader):
+      differ = _lists_differ(x, y, tolerance, ignore, field_path)
+    elif isinstance(x, capnp.lib.capnp._DynamicObjectReader):
+      differ = True  # AnyPointer, leave it to the full comparison
+    else:
+      differ = _values_differ(x, y, tolerance)
+
+    if differ:
+      return True
+  return False
+
+
+def msgs_differ(msg1, msg2, ignore_fields, tolerance) -> bool:
+  """Compares two events field by field, without copying them. False if they are equal up to the tolerance and ignored fields,
+  True if compare_logs may find a difference. Only then the messages need to be turned into dicts."""
+  return _structs_differ(msg1, msg2, tolerance, set(ignore_fields))
+
+
 def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=None,):
   if ignore_fields is None:
     ignore_fields = []
@@ -57,10 +128,20 @@ def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=Non
     raise Exception(f"logs are not same length: {len(log1)} VS {len(log2)}\n\t\t{cnt1}\n\t\t{cnt2}")
 
   diff = []
+  checked_types = set()
   for msg1, msg2 in zip(log1, log2, strict=True):
     if msg1.which() != msg2.which():
       raise Exception("msgs not aligned between logs")
 
+    # unknown or unsupported ignore fields raise, also when all messages are equal
+    if msg1.which() not in checked_types:
+      remove_ignored_fields(msg1, ignore_fields)
+      checked_types.add(msg1.which())
+
+    # most messages are equal or only differ within the tolerance
+    if not msgs_differ(msg1, msg2, ignore_fields, tolerance):
+      continue
+
     msg1 = remove_ignored_fields(msg1, ignore_fields)
     msg2 = remove_ignored_fields(msg2, ignore_fields)
 
@@ -0,0 +1,103 @@
+import importlib
+import multiprocessing
+import os
+import sys
+import traceback
+from collections.abc import Callable
+from multiprocessing.connection import Connection
+from typing import Any
+
+# forked, so the server and the processes it forks inherit the fake events of the replay context
+_mp = multiprocessing.get_context("fork")
+
+
+def _serve(module: str, name: str, launcher: Callable, conn: Connection) -> None:
+  importlib.import_module(module)
+  while True:
+    cmd, arg = conn.recv()
+    if cmd == "exit":
+      break
+    elif cmd == "start":
+      pid = os.fork()
+      if pid == 0:
+        conn.close()
+        code = 0
+        try:
+          # the environment of the segment, the server's own is the one it was started with
+          os.environ.clear()
+          os.environ.update(arg)
+          launcher(module, name)
+        except BaseException:
+          traceback.print_exc()
+          code = 1
+        finally:
+          sys.stdout.flush()
+          sys.stderr.flush()
+          os._exit(code)
+      conn.send(pid)
+    elif cmd == "poll":
+      pid, status = os.waitpid(arg, os.WNOHANG)
+      conn.send(os.waitstatus_to_exitcode(status) if pid != 0 else None)
+    elif cmd == "wait":
+      _, status = os.waitpid(arg, 0)
+      conn.send(os.waitstatus_to_exitcode(status))
+
+
+class ForkServer:
+  """Keeps the module of a python process imported in a server process, and forks a fresh copy of the process from it on
+  every start. Started processes don't share any state, only the imports and the setup before the server was started."""
+  def __init__(self, module: str, name: str, launcher: Callable):
+    self.conn, child_conn = _mp.Pipe()
+    # named like PythonProcess.start names the process, the forked copies keep the name
+    self.proc = _mp.Process(name=name if "modeld" not in name else "MainProcess", target=_serve, args=(module, name, launcher, child_conn))
+    self.proc.start()
+    child_conn.close()
+
+  def _request(self, cmd: str, arg: Any) -> Any:
+    self.conn.send((cmd, arg))
+    return self.conn.recv()
+
+  def start(self) -> 'ForkedProcess':
+    pid: int = self._request("start", dict(os.environ))
+    return ForkedProcess(self, pid)
+
+  def poll(self, pid: int) -> int | None:
+    exitcode: int | None = self._request("poll", pid)
+    return exitcode
+
+  def wait(self, pid: int) -> int:
+    exitcode: int = self._request("wait", pid)
+    return exitcode
+
+  def close(self) -> None:
+    # other forked processes share the pipe, so the server can't wait for it to close
+    try:
+      self.conn.send(("exit", None))
+    except OSError:
+      pass
+    self.conn.close()
+    self.proc.join(5)
+    if self.proc.exitcode is None:
+      self.proc.kill()
+      self.proc.join()
+
+
+class ForkedProcess:
+  """A process started by a ForkServer, with the parts of multiprocessing.Process that ManagerProcess uses."""
+  def __init__(self, server: ForkServer, pid: int):
+    self.server = server
+    self.pid = pid
+    self._exitcode: int | None = None
+
+  @property
+  def exitcode(self) -> int | None:
+    if self._exitcode is None:
+      self._exitcode = self.server.poll(self.pid)
+    return self._exitcode
+
+  def is_alive(self) -> bool:
+    return self.exitcode is None
+
+  def join(self) -> None:
+    if self._exitcode is None:
+      self._exitcode = self.server.wait(self.pid)
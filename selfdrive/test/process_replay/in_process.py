@@ -0,0 +1,199 @@
+import contextlib
+import gc
+import importlib
+import queue
+import threading
+from collections.abc import Iterable, Iterator
+
+import capnp
+
+import cereal.messaging as messaging
+from openpilot.common.params import Params
+from openpilot.system.manager.process import PythonProcess
+from openpilot.system.manager.process_config import managed_processes
+from openpilot.selfdrive.test.process_replay.migration import migrate_all
+from openpilot.selfdrive.test.process_replay.process_replay import ProcessConfig, ProcessContainer, generate_configs, get_process_config
+from openpilot.selfdrive.test.process_replay.scheduler import JobResult, ReplayJob, run_jobs
+from openpilot.tools.lib.logreader import LogIterable, LogReader
+
+# python daemons whose main loop only talks to SubMaster, PubMaster and Params
+IN_PROCESS_PROCS = ("radard", "paramsd", "calibrationd", "torqued", "lagd")
+
+_SubMaster = messaging.SubMaster
+
+
+class _ReplayDone(BaseException):
+  pass
+
+
+def _import_daemon(name: str):
+  proc = managed_processes[name]
+  assert isinstance(proc, PythonProcess), f"{name} is not a python process"
+  return importlib.import_module(proc.module)
+
+
+class _Daemon:
+  """Runs the main() of a daemon in a thread. Each SubMaster.update() of the daemon hands control back to the replay
+  until the next cycle, the same way the fake events of ReplayContext do for a daemon in its own process."""
+  def __init__(self, cfg: ProcessConfig):
+    self.cfg = cfg
+    self.main = _import_daemon(cfg.proc_name).main
+    self.outputs: list[capnp._DynamicStructReader] = []
+    self._to_daemon: queue.SimpleQueue = queue.SimpleQueue()
+    self._to_replay: queue.SimpleQueue = queue.SimpleQueue()
+    self._thread = threading.Thread(target=self._run, name=cfg.proc_name, daemon=True)
+
+  def _run(self) -> None:
+    try:
+      self.main()
+      err: BaseException = RuntimeError(f"{self.cfg.proc_name} exited")
+    except _ReplayDone:
+      return
+    except BaseException as e:
+      err = e
+    self._to_replay.put(err)
+
+  def _wait(self) -> None:
+    err = self._to_replay.get()
+    if err is not None:
+      raise err
+
+  def wait_for_cycle(self) -> tuple[float, list[capnp._DynamicStructReader]]:
+    # called by the daemon
+    self._to_replay.put(None)
+    cycle: tuple[float, list[capnp._DynamicStructReader]] | None = self._to_daemon.get()
+    if cycle is None:
+      raise _ReplayDone
+    return cycle
+
+  def publish(self, s: str, dat) -> None:
+    # called by the daemon
+    if s in self.cfg.subs:
+      self.outputs.append(messaging.log_from_bytes(dat if isinstance(dat, bytes) else dat.to_bytes()))
+
+  def start(self) -> None:
+    self._thread.start()
+    # wait for the first SubMaster.update()
+    self._wait()
+
+  def step(self, cur_time: float, msgs: list[capnp._DynamicStructReader]) -> list[capnp._DynamicStructReader]:
+    self._to_daemon.put((cur_time, msgs))
+    self._wait()
+    # order of draining the subscriber sockets in ProcessContainer.run_step
+    outputs = sorted(self.outputs, key=lambda m: self.cfg.subs.index(m.which()))
+    self.outputs = []
+    return outputs
+
+  def stop(self) -> None:
+    if self._thread.is_alive():
+      self._to_daemon.put(None)
+      self._thread.join()
+
+  @contextlib.contextmanager
+  def patch_messaging(self):
+    daemon = self
+
+    class SubMaster(_SubMaster):
+      def __init__(self, *args, **kwargs):
+        # no sockets, the messages are handed over by the replay
+        sub_sock, poller = messaging.sub_sock, messaging.Poller
+        messaging.sub_sock, messaging.Poller = (lambda *a, **kw: None), (lambda: None)
+        try:
+          super().__init__(*args, **kwargs)
+        finally:
+          messaging.sub_sock, messaging.Poller = sub_sock, poller
+
+      def update(self, timeout: int = 100) -> None:
+        cur_time, msgs = daemon.wait_for_cycle()
+        # sockets are conflated, only the last message of each service is received
+        self.update_msgs(cur_time, list({m.which(): m for m in msgs}.values()))
+
+    class PubMaster:
+      def __init__(self, services: list[str]):
+        self.services = services
+
+      def send(self, s: str, dat) -> None:
+        daemon.publish(s, dat)
+
+      def wait_for_readers_to_update(self, s: str, timeout: int, dt: float = 0.05) -> bool:
+        return True
+
+      def all_readers_updated(self, s: str) -> bool:
+        return True
+
+    orig = messaging.SubMaster, messaging.PubMaster
+    messaging.SubMaster, messaging.PubMaster = SubMaster, PubMaster
+    try:
+      yield
+    finally:
+      messaging.SubMaster, messaging.PubMaster = orig
+
+
+def replay_process_in_process(
+  cfg: ProcessConfig | str, lr: LogIterable, fingerprint: str | None = None, custom_params: dict | None = None
+) -> list[capnp._DynamicStructReader]:
+  """Replays one of IN_PROCESS_PROCS in this process without msgq. The messages are fed to the daemon in the same
+  cycles as replay_process, so the output is the same."""
+  if isinstance(cfg, str):
+    cfg = get_process_config(cfg)
+  assert cfg.proc_name in IN_PROCESS_PROCS, f"{cfg.proc_name} can't be replayed in process"
+
+  all_msgs = migrate_all(lr, manager_states=True, panda_states="pandaStates" in cfg.pubs)
+  all_msgs = sorted(all_msgs, key=lambda msg: msg.logMonoTime)
+  params_config, env_config = generate_configs(all_msgs, fingerprint, custom_params)
+
+  # the container provides the prefix and the environment of the daemon, no process is started
+  container = ProcessContainer(cfg)
+  cfg = container.cfg
+  daemon = _Daemon(cfg)
+  gc_enabled = gc.isenabled()
+  log_msgs = []
+  try:
+    with container.prefix, daemon.patch_messaging():
+      container._setup_env(params_config, env_config)
+      if cfg.config_callback is not None:
+        cfg.config_callback(Params(), cfg, all_msgs)
+      if cfg.init_callback is not None:
+        cfg.init_callback(None, None, all_msgs, fingerprint)
+      daemon.start()
+
+      cnt = 0
+      msg_queue = []
+      for msg in all_msgs:
+        if msg.which() not in cfg.pubs:
+          continue
+
+        end_of_cycle = True
+        if cfg.should_recv_callback is not None:
+          end_of_cycle = cfg.should_recv_callback(msg, cfg, cnt)
+
+        msg_queue.append(msg)
+        if end_of_cycle:
+          for m in daemon.step(msg.logMonoTime * 1e-9, msg_queue):
+            m = m.as_builder()
+            m.logMonoTime = msg.logMonoTime + int(cfg.processing_time * 1e9)
+            log_msgs.append(m.as_reader())
+          msg_queue = []
+          cnt += 1
+  finally:
+    daemon.stop()
+    container.stop()
+    # config_realtime_process disables the garbage collector of the daemon, which is ours
+    if gc_enabled:
+      gc.enable()
+
+  return log_msgs
+
+
+def _replay_job(name: str, log_path: str) -> bytes:
+  return b"".join(m.as_builder().to_bytes() for m in replay_process_in_process(name, LogReader(log_path)))
+
+
+def replay_in_process_batch(name: str, log_paths: Iterable[str], workers: int, timeout: float | None = None,
+                            disable_progress: bool = False) -> Iterator[JobResult]:
+  """Replays name on each log in its own job, see scheduler.run_jobs. The result of a job is the output log as bytes,
+  readable with LogReader.from_bytes."""
+  # imported once, the forked jobs share it
+  _import_daemon(name)
+  jobs = [ReplayJob(log_path, _replay_job, (name, log_path), timeout) for log_path in log_paths]
+  yield from run_jobs(jobs, workers, desc=f"Replaying {name}", disable_progress=disable_progress)
@@ -1,5 +1,7 @@
+import heapq
+import itertools
 from collections import defaultdict
-from collections.abc import Callable
+from collections.abc import Callable, Iterator
 import capnp
 import functools
 import traceback
@@ -28,7 +30,7 @@ MigrationFunc = Callable[[list[MessageWithIndex]], MigrationOps]
 # 3. product is the message type created by the migration function, and the function will be skipped if product type already exists in lr
 # 4. it must return a list of operations to be applied to the logreader (replace, add, delete)
 # 5. all migration functions must be independent of each other
-def migrate_all(lr: LogIterable, manager_states: bool = False, panda_states: bool = False, camera_states: bool = False):
+def get_migrations(manager_states: bool = False, panda_states: bool = False, camera_states: bool = False) -> list[MigrationFunc]:
   migrations = [
     migrate_sensorEvents,
     migrate_carParams,
@@ -51,38 +53,75 @@ def migrate_all(lr: LogIterable, manager_states: bool = False, panda_states: boo
     migrations.extend([migrate_pandaStates, migrate_peripheralState])
   if camera_states:
     migrations.append(migrate_cameraStates)
+  return migrations
+
 
-  return migrate(lr, migrations)
+def migrate_all(lr: LogIterable, manager_states: bool = False, panda_states: bool = False, camera_states: bool = False):
+  return migrate(lr, get_migrations(manager_states, panda_states, camera_states))
 
 
 def migrate(lr: LogIterable, migration_funcs: list[MigrationFunc]):
-  lr = list(lr)
-  grouped = defaultdict(list)
-  for i, msg in enumerate(lr):
-    grouped[msg.which()].append(i)
+  return list(migrate_iter(lr, migration_funcs))
 
-  replace_ops, add_ops, del_ops = [], [], []
+
+def _collect_ops(lr: LogIterable, migration_funcs: list[MigrationFunc]) -> tuple[MigrationOps, bool]:
+  # only the inputs of migrations whose product wasn't seen yet are kept
+  inputs: dict[MigrationFunc, list[MessageWithIndex]] = {migration: [] for migration in migration_funcs}
+  by_service: dict[str, list[MigrationFunc]] = defaultdict(list)
+  by_product: dict[str, list[MigrationFunc]] = defaultdict(list)
   for migration in migration_funcs:
     assert hasattr(migration, "inputs") and hasattr(migration, "product"), "Migration functions must use @migration decorator"
-    if migration.product in grouped: # skip if product already exists
-      continue
+    for service in migration.inputs:
+      by_service[service].append(migration)
+    if migration.product is not None:
+      by_product[migration.product].append(migration)
 
-    sorted_indices = sorted(ii for i in migration.inputs for ii in grouped[i])
-    msg_gen = [(i, lr[i]) for i in sorted_indices]
-    r_ops, a_ops, d_ops = migration(msg_gen)
+  ordered, last_time = True, 0
+  for i, msg in enumerate(lr):
+    ordered = ordered and msg.logMonoTime >= last_time
+    last_time = msg.logMonoTime
+
+    which = msg.which()
+    for migration in by_product.pop(which, []):
+      # skip if product already exists
+      del inputs[migration]
+    for migration in by_service.get(which, []):
+      if migration in inputs:
+        inputs[migration].append((i, msg))
+
+  replace_ops, add_ops, del_ops = [], [], []
+  for migration, msgs in inputs.items():
+    r_ops, a_ops, d_ops = migration(msgs)
     replace_ops.extend(r_ops)
     add_ops.extend(a_ops)
     del_ops.extend(d_ops)
-
-  for index, msg in replace_ops:
-    lr[index] = msg
-  for index in sorted(del_ops, reverse=True):
-    del lr[index]
-  for msg in add_ops:
-    lr.append(msg)
-  lr = sorted(lr, key=lambda x: x.logMonoTime)
-
-  return lr
+  return (replace_ops, add_ops, del_ops), ordered
+
+
+def migrate_iter(lr: LogIterable, migration_funcs: list[MigrationFunc]) -> Iterator[capnp.lib.capnp._DynamicStructReader]:
+  """Yields the migrated log in time order, without building a migrated copy of the whole log. The log is read twice,
+  first for the inputs of the migrations and then to apply their operations by index. A default LogReader keeps its
+  decoded files, so the second pass is free but the log stays in memory. Only a LogReader with stream=True keeps nothing
+  in memory, it decompresses its files again on the second pass. Single use iterators are read into a list."""
+  if iter(lr) is lr:
+    lr = list(lr)
+
+  (replace_ops, add_ops, del_ops), ordered = _collect_ops(lr, migration_funcs)
+  replaced = dict(replace_ops)
+  deleted = set(del_ops)
+  del replace_ops, del_ops
+
+  def migrated():
+    for i, msg in enumerate(lr):
+      if i not in deleted:
+        yield replaced.pop(i, msg)
+
+  # only the added messages need sorting when the log is in order, merging keeps them after log messages with equal times
+  add_ops.sort(key=lambda x: x.logMonoTime)
+  if ordered:
+    yield from heapq.merge(migrated(), add_ops, key=lambda x: x.logMonoTime)
+  else:
+    yield from sorted(itertools.chain(migrated(), add_ops), key=lambda x: x.logMonoTime)
 
 
 def migration(inputs: list[str], product: str|None=None):
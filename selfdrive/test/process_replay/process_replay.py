@@ -3,13 +3,15 @@ import os
 import time
 import copy
 import heapq
+import itertools
 import signal
-from collections import Counter, OrderedDict
+from collections import Counter, OrderedDict, deque
 from dataclasses import dataclass, field
 from typing import Any
 from collections.abc import Callable, Iterable
 from tqdm import tqdm
 import capnp
+import numpy as np
 from openpilot.system.hardware.hw import Paths
 
 import cereal.messaging as messaging
@@ -22,10 +24,12 @@ from openpilot.common.prefix import OpenpilotPrefix
 from openpilot.common.timeout import Timeout
 from openpilot.common.realtime import DT_CTRL
 from openpilot.selfdrive.car.card import can_comm_callbacks
+from openpilot.system.manager.process import PythonProcess
 from openpilot.system.manager.process_config import managed_processes
 from openpilot.selfdrive.test.process_replay.vision_meta import meta_from_camera_state, available_streams
 from openpilot.selfdrive.test.process_replay.migration import migrate_all
 from openpilot.selfdrive.test.process_replay.capture import ProcessOutputCapture
+from openpilot.selfdrive.test.process_replay.fork_server import ForkServer
 from openpilot.tools.lib.logreader import LogIterable
 from openpilot.tools.lib.framereader import FrameReader
 
@@ -75,8 +79,7 @@ class ReplayContext:
     self.close_context()
 
   def open_context(self):
-    messaging.toggle_fake_events(True)
-    messaging.set_fake_prefix(self.proc_name)
+    self.enable_fake_events()
 
     if self.main_pub is None:
       self.events = OrderedDict()
@@ -88,10 +91,22 @@ class ReplayContext:
 
   def close_context(self):
     del self.events
+    self.disable_fake_events()
 
+  def enable_fake_events(self):
+    messaging.toggle_fake_events(True)
+    messaging.set_fake_prefix(self.proc_name)
+
+  def disable_fake_events(self):
     messaging.toggle_fake_events(False)
     messaging.delete_fake_prefix()
 
+  def clear_events(self):
+    # a killed process can leave its events set
+    for man in self.events.values():
+      man.recv_called_event.clear()
+      man.recv_ready_event.clear()
+
   @property
   def all_recv_called_events(self):
     return [man.recv_called_event for man in self.events.values()]
@@ -146,10 +161,12 @@ class ProcessConfig:
 
 
 class ProcessContainer:
-  def __init__(self, cfg: ProcessConfig):
+  def __init__(self, cfg: ProcessConfig, fork_server: bool = False):
     self.prefix = OpenpilotPrefix(clean_dirs_on_exit=False)
+    self.base_cfg = cfg
     self.cfg = copy.deepcopy(cfg)
     self.process = copy.deepcopy(managed_processes[cfg.proc_name])
+    self.launcher: Callable = self.process.launcher  # type: ignore[attr-defined]
     self.msg_queue: list[capnp._DynamicStructReader] = []
     self.cnt = 0
     self.pm: messaging.PubMaster | None = None
@@ -158,6 +175,9 @@ class ProcessContainer:
     self.vipc_server: VisionIpcServer | None = None
     self.environ_config: dict[str, Any] | None = None
     self.capture: ProcessOutputCapture | None = None
+    # python processes are forked from a server kept across starts, which shares the replay context with them
+    self.use_fork_server = fork_server
+    self.fork_server: ForkServer | None = None
 
   @property
   def has_empty_queue(self) -> bool:
@@ -172,7 +192,7 @@ class ProcessContainer:
     return self.cfg.subs
 
   def _clean_env(self):
-    for k in self.environ_config.keys():
+    for k in (self.environ_config or {}).keys():
       if k in os.environ:
         del os.environ[k]
 
@@ -218,8 +238,13 @@ class ProcessContainer:
     self.cfg.vision_pubs = [meta.camera_state for meta in streams_metas if meta.camera_state in self.cfg.vision_pubs]
 
   def _start_process(self):
-    if self.capture is not None:
-      self.process.launcher = LauncherWithCapture(self.capture, self.process.launcher)
+    if self.use_fork_server and self.capture is None and isinstance(self.process, PythonProcess):
+      if self.fork_server is None:
+        self.fork_server = ForkServer(self.process.module, self.process.name, self.launcher)
+      self.process.proc = self.fork_server.start()
+      return
+
+    self.process.launcher = LauncherWithCapture(self.capture, self.launcher) if self.capture is not None else self.launcher
     self.process.prepare()
     self.process.start()
 
@@ -235,17 +260,27 @@ class ProcessContainer:
         params = Params()
         self.cfg.config_callback(params, self.cfg, all_msgs)
 
-      self.rc = ReplayContext(self.cfg)
-      self.rc.open_context()
+      # the processes forked by the server inherited the fake events of the kept context
+      if self.rc is not None and set(self.rc.pubs) != set(self.cfg.pubs):
+        self._close_fork_server()
+      if self.rc is None:
+        self.rc = ReplayContext(self.cfg)
+        self.rc.open_context()
+      else:
+        self.rc.enable_fake_events()
 
       self.pm = messaging.PubMaster(self.cfg.pubs)
-      self.sockets = [messaging.sub_sock(s, timeout=100) for s in self.cfg.subs]
+      # kept across resets
+      if self.sockets is None:
+        self.sockets = [messaging.sub_sock(s, timeout=100) for s in self.cfg.subs]
 
       if len(self.cfg.vision_pubs) != 0:
         assert frs is not None
         self._setup_vision_ipc(all_msgs, frs)
         assert self.vipc_server is not None
 
+      # drop the capture of a previous start first, it removes its files which have the same names
+      self.capture = None
       if capture_output:
         self.capture = ProcessOutputCapture(self.cfg.proc_name, p.prefix)
 
@@ -259,13 +294,45 @@ class ProcessContainer:
         while not all(self.pm.all_readers_updated(s) for s in self.cfg.pubs if s not in self.cfg.ignore_alive_pubs):
           time.sleep(0)
 
-  def stop(self):
+  def reset(self):
+    """Prepares the container for the next start(): the process under test is killed, params, environment and queues
+    are cleared, and outputs left in the sockets are dropped. The prefix, the subscriber sockets and the fork server with
+    its replay context are kept."""
     with self.prefix:
       self.process.signal(signal.SIGKILL)
       self.process.stop()
-      self.rc.close_context()
-      self.prefix.clean_dirs()
+      if self.fork_server is not None:
+        assert self.rc is not None
+        self.rc.clear_events()
+        self.rc.disable_fake_events()
+      elif self.rc is not None:
+        self.rc.close_context()
+        self.rc = None
       self._clean_env()
+      Params().clear_all()
+      for socket in self.sockets or []:
+        messaging.drain_sock_raw(socket)
+
+    self.cfg = copy.deepcopy(self.base_cfg)
+    self.msg_queue = []
+    self.cnt = 0
+    self.pm = None
+    self.vipc_server = None
+    self.environ_config = None
+
+  def _close_fork_server(self):
+    assert self.fork_server is not None
+    self.fork_server.close()
+    self.fork_server = None
+    # the fake events were disabled by reset
+    self.rc = None
+
+  def stop(self):
+    self.reset()
+    with self.prefix:
+      if self.fork_server is not None:
+        self._close_fork_server()
+      self.prefix.clean_dirs()
 
   def run_step(self, msg: capnp._DynamicStructReader, frs: dict[str, FrameReader] | None) -> list[capnp._DynamicStructReader]:
     assert self.rc and self.pm and self.sockets and self.process.proc
@@ -298,7 +365,8 @@ class ProcessContainer:
             camera_meta = meta_from_camera_state(m.which())
             assert frs is not None
             img = frs[m.which()].get(camera_state.frameId)
-            self.vipc_server.send(camera_meta.stream, img.flatten().tobytes(),
+            # nv12 frames already have the VisionIPC buffer layout, send a flat view instead of copies
+            self.vipc_server.send(camera_meta.stream, np.ascontiguousarray(img).reshape(-1),
                                   camera_state.frameId, camera_state.timestampSof, camera_state.timestampEof)
         self.msg_queue = []
 
@@ -655,7 +723,8 @@ def replay_process_with_name(name: str | Iterable[str], lr: LogIterable, *args,
 def replay_process(
   cfg: ProcessConfig | Iterable[ProcessConfig], lr: LogIterable, frs: dict[str, FrameReader] = None,
   fingerprint: str = None, return_all_logs: bool = False, custom_params: dict[str, Any] = None,
-  captured_output_store: dict[str, dict[str, str]] = None, disable_progress: bool = False
+  captured_output_store: dict[str, dict[str, str]] = None, disable_progress: bool = False,
+  containers: list[ProcessContainer] | None = None
 ) -> list[capnp._DynamicStructReader]:
   if isinstance(cfg, Iterable):
     cfgs = list(cfg)
@@ -666,31 +735,47 @@ def replay_process(
                          manager_states=True,
                          panda_states=any("pandaStates" in cfg.pubs for cfg in cfgs),
                          camera_states=any(len(cfg.vision_pubs) != 0 for cfg in cfgs))
-  process_logs = _replay_multi_process(cfgs, all_msgs, frs, fingerprint, custom_params, captured_output_store, disable_progress)
+  process_logs = _replay_multi_process(cfgs, all_msgs, frs, fingerprint, custom_params, captured_output_store, disable_progress, containers)
 
   if return_all_logs:
     keys = {m.which() for m in process_logs}
-    modified_logs = [m for m in all_msgs if m.which() not in keys]
-    modified_logs.extend(process_logs)
-    modified_logs.sort(key=lambda m: int(m.logMonoTime))
-    log_msgs = modified_logs
+    # both are in time order, on equal times log messages go first like a stable sort of both
+    kept_logs = (m for m in all_msgs if m.which() not in keys)
+    log_msgs = list(heapq.merge(kept_logs, sorted(process_logs, key=lambda m: m.logMonoTime), key=lambda m: m.logMonoTime))
   else:
     log_msgs = process_logs
 
   return log_msgs
 
 
+class ReplayWorker:
+  """Replays segments one after another through the same processes. The containers are kept between replays and reset
+  through ProcessContainer.reset. Python processes stay imported in a fork server and every segment gets a fresh fork of
+  them, so no state is carried over while the prefix, sockets, replay context and imports are reused."""
+  def __init__(self, cfg: ProcessConfig | Iterable[ProcessConfig]):
+    self.cfgs = list(cfg) if isinstance(cfg, Iterable) else [cfg]
+    self.containers = [ProcessContainer(cfg, fork_server=True) for cfg in self.cfgs]
+
+  def replay(self, lr: LogIterable, **kwargs) -> list[capnp._DynamicStructReader]:
+    return replay_process(self.cfgs, lr, containers=self.containers, **kwargs)
+
+  def close(self) -> None:
+    for container in self.containers:
+      container.stop()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_obj, exc_tb):
+    self.close()
+
+
 def _replay_multi_process(
   cfgs: list[ProcessConfig], lr: LogIterable, frs: dict[str, FrameReader] | None, fingerprint: str | None,
-  custom_params: dict[str, Any] | None, captured_output_store: dict[str, dict[str, str]] | None, disable_progress: bool
+  custom_params: dict[str, Any] | None, captured_output_store: dict[str, dict[str, str]] | None, disable_progress: bool,
+  containers: list[ProcessContainer] | None = None
 ) -> list[capnp._DynamicStructReader]:
-  if fingerprint is not None:
-    params_config = generate_params_config(lr=lr, fingerprint=fingerprint, custom_params=custom_params)
-    env_config = generate_environ_config(fingerprint=fingerprint)
-  else:
-    CP = next((m.carParams for m in lr if m.which() == "carParams"), None)
-    params_config = generate_params_config(lr=lr, CP=CP, custom_params=custom_params)
-    env_config = generate_environ_config(CP=CP)
+  params_config, env_config = generate_configs(lr, fingerprint, custom_params)
 
   # validate frs and vision pubs
   all_vision_pubs = [pub for cfg in cfgs for pub in cfg.vision_pubs]
@@ -701,13 +786,17 @@ def _replay_multi_process(
     required_vision_pubs = {m.camera_state for m in available_streams(lr)} & set(all_vision_pubs)
     assert all(st in frs for st in required_vision_pubs), f"frs for this process must contain following vision streams: {required_vision_pubs}"
 
-  all_msgs = sorted(lr, key=lambda msg: msg.logMonoTime)
+  all_msgs = sort_by_time(lr)
   log_msgs = []
+  reuse_containers = containers is not None
+  if containers is None:
+    containers = [ProcessContainer(cfg) for cfg in cfgs]
+  assert [c.base_cfg.proc_name for c in containers] == [cfg.proc_name for cfg in cfgs]
+
+  started: list[ProcessContainer] = []
   try:
-    containers = []
-    for cfg in cfgs:
-      container = ProcessContainer(cfg)
-      containers.append(container)
+    for container in containers:
+      started.append(container)
       container.start(params_config, env_config, all_msgs, frs, fingerprint, captured_output_store is not None)
 
     all_pubs = {pub for container in containers for pub in container.pubs}
@@ -715,33 +804,34 @@ def _replay_multi_process(
     lr_pubs = all_pubs - all_subs
     pubs_to_containers = {pub: [container for container in containers if pub in container.pubs] for pub in all_pubs}
 
-    pub_msgs = [msg for msg in all_msgs if msg.which() in lr_pubs]
-    # external queue for messages taken from logs; internal queue for messages generated by processes, which will be republished
-    external_pub_queue: list[capnp._DynamicStructReader] = pub_msgs.copy()
-    internal_pub_queue: list[capnp._DynamicStructReader] = []
-    # heap for maintaining the order of messages generated by processes, where each element: (logMonoTime, index in internal_pub_queue)
-    internal_pub_index_heap: list[tuple[int, int]] = []
+    # external queue for messages taken from logs; internal heap for messages generated by processes, which will be republished.
+    # both are merged by logMonoTime, internal messages with equal times are republished in the order they were generated
+    external_pub_queue: deque[capnp._DynamicStructReader] = deque(msg for msg in all_msgs if msg.which() in lr_pubs)
+    internal_pub_heap: list[tuple[int, int, capnp._DynamicStructReader]] = []
+    internal_pub_cnt = itertools.count()
 
     pbar = tqdm(total=len(external_pub_queue), disable=disable_progress)
-    while len(external_pub_queue) != 0 or (len(internal_pub_index_heap) != 0 and not all(c.has_empty_queue for c in containers)):
-      if len(internal_pub_index_heap) == 0 or (len(external_pub_queue) != 0 and external_pub_queue[0].logMonoTime < internal_pub_index_heap[0][0]):
-        msg = external_pub_queue.pop(0)
+    while len(external_pub_queue) != 0 or (len(internal_pub_heap) != 0 and not all(c.has_empty_queue for c in containers)):
+      if len(internal_pub_heap) == 0 or (len(external_pub_queue) != 0 and external_pub_queue[0].logMonoTime < internal_pub_heap[0][0]):
+        msg = external_pub_queue.popleft()
         pbar.update(1)
       else:
-        _, index = heapq.heappop(internal_pub_index_heap)
-        msg = internal_pub_queue[index]
+        _, _, msg = heapq.heappop(internal_pub_heap)
 
       target_containers = pubs_to_containers[msg.which()]
       for container in target_containers:
         output_msgs = container.run_step(msg, frs)
         for m in output_msgs:
           if m.which() in all_pubs:
-            internal_pub_queue.append(m)
-            heapq.heappush(internal_pub_index_heap, (m.logMonoTime, len(internal_pub_queue) - 1))
+            heapq.heappush(internal_pub_heap, (m.logMonoTime, next(internal_pub_cnt), m))
         log_msgs.extend(output_msgs)
   finally:
-    for container in containers:
-      container.stop()
+    for container in started:
+      # reused containers keep their prefix and sockets for the next replay
+      if reuse_containers:
+        container.reset()
+      else:
+        container.stop()
       if captured_output_store is not None:
         assert container.capture is not None
         out, err = container.capture.read_outerr()
@@ -750,6 +840,27 @@ def _replay_multi_process(
   return log_msgs
 
 
+def sort_by_time(msgs: LogIterable) -> list[capnp._DynamicStructReader]:
+  # migrated logs are already in order, skip sorting them again
+  msgs = msgs if isinstance(msgs, list) else list(msgs)
+  times = [m.logMonoTime for m in msgs]
+  if all(a <= b for a, b in itertools.pairwise(times)):
+    return msgs
+  return [msgs[i] for i in sorted(range(len(msgs)), key=times.__getitem__)]
+
+
+def generate_configs(lr: LogIterable, fingerprint: str | None = None,
+                     custom_params: dict[str, Any] | None = None) -> tuple[dict[str, Any], dict[str, Any]]:
+  if fingerprint is not None:
+    params_config = generate_params_config(lr=lr, fingerprint=fingerprint, custom_params=custom_params)
+    env_config = generate_environ_config(fingerprint=fingerprint)
+  else:
+    CP = next((m.carParams for m in lr if m.which() == "carParams"), None)
+    params_config = generate_params_config(lr=lr, CP=CP, custom_params=custom_params)
+    env_config = generate_environ_config(CP=CP)
+  return params_config, env_config
+
+
 def generate_params_config(lr=None, CP=None, fingerprint=None, custom_params=None) -> dict[str, Any]:
   params_dict = {
     "OpenpilotEnabledToggle": True,
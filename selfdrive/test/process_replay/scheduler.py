@@ -0,0 +1,130 @@
+import multiprocessing
+import os
+import signal
+import time
+import traceback
+import uuid
+from collections import deque
+from collections.abc import Callable, Hashable, Iterable, Iterator
+from dataclasses import dataclass, field
+from multiprocessing.connection import Connection, wait
+from typing import Any, cast
+
+from tqdm import tqdm
+
+from openpilot.common.prefix import OpenpilotPrefix
+
+# jobs are forked to share the parent's imports and inputs without pickling them
+_mp = multiprocessing.get_context("fork")
+
+
+@dataclass
+class ReplayJob:
+  key: Hashable
+  func: Callable[..., Any]
+  args: tuple = ()
+  timeout: float | None = None   # seconds, None waits forever
+
+
+@dataclass
+class JobResult:
+  key: Hashable
+  result: Any = None
+  error: str | None = None
+  timed_out: bool = False
+  duration: float = 0.
+
+  @property
+  def ok(self) -> bool:
+    return self.error is None
+
+
+@dataclass
+class _RunningJob:
+  job: ReplayJob
+  proc: multiprocessing.process.BaseProcess
+  prefix: str
+  start: float = field(default_factory=time.monotonic)
+
+  @property
+  def deadline(self) -> float:
+    return self.start + self.job.timeout if self.job.timeout is not None else float("inf")
+
+
+def _run_job(job: ReplayJob, prefix: str, conn: Connection) -> None:
+  # own process group, so the processes under test are killed with the job on timeout
+  os.setsid()
+  try:
+    with OpenpilotPrefix(prefix, shared_download_cache=True):
+      res = JobResult(job.key, result=job.func(*job.args))
+  except Exception:
+    res = JobResult(job.key, error=traceback.format_exc())
+  try:
+    conn.send(res)
+  except Exception:
+    # e.g. a result that can't be pickled
+    conn.send(JobResult(job.key, error=traceback.format_exc()))
+  conn.close()
+
+
+def _kill(running: _RunningJob) -> None:
+  assert running.proc.pid is not None
+  try:
+    os.killpg(running.proc.pid, signal.SIGKILL)
+  except ProcessLookupError:
+    pass
+  running.proc.join()
+  # the job can't clean up after itself when killed
+  with OpenpilotPrefix(running.prefix):
+    pass
+
+
+def run_jobs(jobs: Iterable[ReplayJob], workers: int, desc: str | None = None, disable_progress: bool = False) -> Iterator[JobResult]:
+  """Runs each job in a forked process with its own openpilot prefix, at most workers at a time.
+  Results are yielded as jobs finish, failed and timed out jobs are reported in the result instead of raised."""
+  pending = deque(jobs)
+  running: dict[Connection, _RunningJob] = {}
+  pbar = tqdm(total=len(pending), desc=desc, disable=disable_progress)
+  try:
+    while len(pending) or len(running):
+      while len(pending) and len(running) < workers:
+        job = pending.popleft()
+        recv_conn, send_conn = _mp.Pipe(duplex=False)
+        prefix = uuid.uuid4().hex[:15]
+        proc = _mp.Process(target=_run_job, args=(job, prefix, send_conn))
+        proc.start()
+        send_conn.close()
+        running[recv_conn] = _RunningJob(job, proc, prefix)
+
+      next_deadline = min(r.deadline for r in running.values())
+      ready = wait(list(running), timeout=max(0., next_deadline - time.monotonic()) if next_deadline != float("inf") else None)
+
+      finished: list[JobResult] = []
+      for conn in cast(list[Connection], ready):
+        r = running.pop(conn)
+        try:
+          res: JobResult = conn.recv()
+        except EOFError:
+          _kill(r)
+          res = JobResult(r.job.key, error=f"job exited with code {r.proc.exitcode}")
+        conn.close()
+        r.proc.join()
+        res.duration = time.monotonic() - r.start
+        finished.append(res)
+
+      now = time.monotonic()
+      for conn, r in list(running.items()):
+        if now >= r.deadline:
+          del running[conn]
+          _kill(r)
+          conn.close()
+          finished.append(JobResult(r.job.key, error=f"timed out after {r.job.timeout}s", timed_out=True, duration=now - r.start))
+
+      for res in finished:
+        pbar.update(1)
+        yield res
+  finally:
+    for conn, r in running.items():
+      _kill(r)
+      conn.close()
+    pbar.close()
@@ -0,0 +1,77 @@
+import random
+import pytest
+from hypothesis import given, HealthCheck, Phase, settings
+import hypothesis.strategies as st
+
+from cereal import log
+from openpilot.selfdrive.test.fuzzy_generation import FuzzyGenerator
+import openpilot.selfdrive.test.process_replay.compare_logs as cl
+
+SERVICES = ["carState", "controlsState", "radarState", "liveCalibration", "liveTracks", "can"]
+IGNORE_FIELDS = ["logMonoTime", "carState.vEgo", "radarState.leadOne.dRel", "liveCalibration.rpyCalib"]
+
+
+def perturb(value, rng: random.Random, tolerance: float):
+  if isinstance(value, dict):
+    return {k: perturb(v, rng, tolerance) for k, v in value.items()}
+  if isinstance(value, list):
+    value = [perturb(v, rng, tolerance) for v in value]
+    return value[:-1] if len(value) and rng.random() < 0.05 else value
+  if rng.random() > 0.1:
+    return value
+
+  if isinstance(value, bool):
+    return not value
+  if isinstance(value, int):
+    return value ^ 1
+  if isinstance(value, float):
+    # inside or outside of the tolerance
+    return value + rng.choice([-1, 1]) * rng.choice([0.1, 0.5, 2., 10.]) * tolerance * max(1., abs(value))
+  return value
+
+
+def full_diff(monkeypatch, *args, **kwargs):
+  # every message goes through the dictdiffer comparison
+  with monkeypatch.context() as m:
+    m.setattr(cl, "msgs_differ", lambda *_: True)
+    return cl.compare_logs(*args, **kwargs)
+
+
+class TestCompareLogs:
+  @given(st.data())
+  @settings(phases=[Phase.generate, Phase.target], max_examples=100, deadline=None,
+            suppress_health_check=[HealthCheck.too_slow, HealthCheck.data_too_large, HealthCheck.function_scoped_fixture])
+  def test_matches_full_diff(self, monkeypatch, data):
+    tolerance = data.draw(st.sampled_from([None, 1e-3]))
+    rng = random.Random(data.draw(st.integers()))
+    msgs = FuzzyGenerator.get_random_event_msg(data.draw, events=SERVICES)
+    log1 = [log.Event.new_message(**m).as_reader() for m in msgs]
+    log2 = [log.Event.new_message(**perturb(m, rng, tolerance or cl.EPSILON)).as_reader() for m in msgs]
+
+    for ignore_fields in ([], IGNORE_FIELDS):
+      for a, b in ((log1, log1), (log1, log2), (log2, log1)):
+        # compared as text, nan != nan
+        diff = cl.compare_logs(a, b, ignore_fields, tolerance=tolerance)
+        assert repr(diff) == repr(full_diff(monkeypatch, a, b, ignore_fields, tolerance=tolerance))
+
+  def test_msgs_differ(self):
+    msg = log.Event.new_message(carState={"vEgo": 1., "wheelSpeeds": {"fl": 2.}, "canValid": True})
+    assert not cl.msgs_differ(msg.as_reader(), msg.as_reader(), [], cl.EPSILON)
+
+    msg2 = msg.copy()
+    msg2.carState.vEgo = 1.001
+    assert cl.msgs_differ(msg.as_reader(), msg2.as_reader(), [], cl.EPSILON)
+    assert not cl.msgs_differ(msg.as_reader(), msg2.as_reader(), [], 1e-2)
+    assert not cl.msgs_differ(msg.as_reader(), msg2.as_reader(), ["carState.vEgo"], cl.EPSILON)
+
+    msg2 = msg.copy()
+    msg2.carState.wheelSpeeds.fl = 3.
+    assert cl.msgs_differ(msg.as_reader(), msg2.as_reader(), ["carState.vEgo"], cl.EPSILON)
+
+  def test_unsupported_ignore_field(self):
+    # the messages are equal, the comparison has to fail anyway
+    lr = [log.Event.new_message(carState={"vEgo": 1.}).as_reader()]
+    with pytest.raises(NotImplementedError):
+      cl.compare_logs(lr, lr, ["carState.cruiseState"])
+    with pytest.raises(AttributeError):
+      cl.compare_logs(lr, lr, ["carState.notAField"])
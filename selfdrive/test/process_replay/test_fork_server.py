@@ -0,0 +1,48 @@
+import os
+import signal
+import time
+
+from openpilot.selfdrive.test.process_replay.fork_server import ForkServer
+
+
+def write_env_launcher(proc: str, name: str) -> None:
+  with open(os.environ["OUT_FN"], "w") as f:
+    f.write(f"{proc} {name} {os.environ['SEGMENT']} {os.getppid()}")
+  os._exit(int(os.environ["SEGMENT"]))
+
+
+def sleep_launcher(proc: str, name: str) -> None:
+  time.sleep(100)
+
+
+class TestForkServer:
+  def test_start(self, tmp_path, monkeypatch):
+    server = ForkServer("json", "jsond", write_env_launcher)
+    try:
+      for segment in range(3):
+        out_fn = str(tmp_path / f"out_{segment}")
+        monkeypatch.setenv("OUT_FN", out_fn)
+        monkeypatch.setenv("SEGMENT", str(segment))
+        proc = server.start()
+        proc.join()
+        assert proc.exitcode == segment
+        assert not proc.is_alive()
+
+        # every start is a new fork of the same server, with the environment at the time of the start
+        with open(out_fn) as f:
+          assert f.read() == f"json jsond {segment} {server.proc.pid}"
+    finally:
+      server.close()
+    assert server.proc.exitcode == 0
+
+  def test_kill(self):
+    server = ForkServer("json", "jsond", sleep_launcher)
+    try:
+      proc = server.start()
+      assert proc.is_alive()
+      os.kill(proc.pid, signal.SIGKILL)
+      proc.join()
+      assert proc.exitcode == -signal.SIGKILL
+      assert server.proc.is_alive()
+    finally:
+      server.close()
@@ -0,0 +1,39 @@
+import functools
+import pytest
+from parameterized import parameterized
+
+from openpilot.selfdrive.test.process_replay.compare_logs import compare_logs
+from openpilot.selfdrive.test.process_replay.in_process import IN_PROCESS_PROCS, replay_process_in_process
+from openpilot.selfdrive.test.process_replay.process_replay import get_process_config, replay_process
+from openpilot.selfdrive.test.process_replay.test_processes import segments
+from openpilot.selfdrive.test.process_replay.test_replay_worker import FINGERPRINT, synthetic_log
+from openpilot.tools.lib.openpilotci import get_url
+from openpilot.tools.lib.logreader import LogReader
+
+TESTED_SEGMENT = dict(segments)["TOYOTA"]
+
+
+@functools.cache
+def route_log() -> list:
+  return list(LogReader(get_url(*TESTED_SEGMENT.rsplit("--", 1), "rlog.zst")))
+
+
+def assert_matches_process_replay(proc_name, lr, fingerprint=None):
+  cfg = get_process_config(proc_name)
+  ref_msgs = replay_process(cfg, lr, fingerprint=fingerprint, disable_progress=True)
+  msgs = replay_process_in_process(cfg, lr, fingerprint=fingerprint)
+
+  assert len(msgs) == len(ref_msgs) > 0
+  assert compare_logs(ref_msgs, msgs, cfg.ignore, tolerance=cfg.tolerance) == []
+
+
+class TestInProcessReplay:
+  @parameterized.expand([(proc,) for proc in IN_PROCESS_PROCS])
+  def test_synthetic_log(self, proc_name):
+    assert_matches_process_replay(proc_name, synthetic_log(0), FINGERPRINT)
+
+  @parameterized.expand([(proc,) for proc in IN_PROCESS_PROCS])
+  @pytest.mark.slow
+  @pytest.mark.shared_download_cache
+  def test_matches_process_replay(self, proc_name):
+    assert_matches_process_replay(proc_name, route_log())
@@ -0,0 +1,132 @@
+import random
+from collections import defaultdict
+import pytest
+
+from cereal import log
+from openpilot.selfdrive.modeld.constants import ModelConstants
+from openpilot.selfdrive.test.process_replay.migration import get_migrations, migrate, migrate_iter
+from openpilot.tools.lib.logreader import LogReader, _LogFileReader, save_log
+
+OLD_FINGERPRINT = "TOYOTA PRIUS 2017"
+
+
+def reference_migrate(lr, migration_funcs):
+  # migrate before it was streamed, on a list of the whole log
+  lr = list(lr)
+  grouped = defaultdict(list)
+  for i, msg in enumerate(lr):
+    grouped[msg.which()].append(i)
+
+  replace_ops, add_ops, del_ops = [], [], []
+  for migration in migration_funcs:
+    if migration.product in grouped:
+      continue
+
+    sorted_indices = sorted(ii for i in migration.inputs for ii in grouped[i])
+    r_ops, a_ops, d_ops = migration([(i, lr[i]) for i in sorted_indices])
+    replace_ops.extend(r_ops)
+    add_ops.extend(a_ops)
+    del_ops.extend(d_ops)
+
+  for index, msg in replace_ops:
+    lr[index] = msg
+  for index in sorted(del_ops, reverse=True):
+    del lr[index]
+  for msg in add_ops:
+    lr.append(msg)
+  return sorted(lr, key=lambda x: x.logMonoTime)
+
+
+def old_log(seed: int, seconds: int = 2) -> list:
+  # a log from before the migrated services were added, with repeated times like in real logs
+  rng = random.Random(seed)
+  msgs = []
+
+  def add(t: int, **kwargs) -> None:
+    msgs.append(log.Event.new_message(logMonoTime=t, valid=True, **kwargs).as_reader())
+
+  def floats(n: int) -> list[float]:
+    return [rng.uniform(-1, 1) for _ in range(n)]
+
+  def xyz() -> dict:
+    return {"value": floats(3), "std": floats(3), "valid": True}
+
+  add(0, initData={"deviceType": "tici"})
+  add(0, carParams={"carFingerprint": OLD_FINGERPRINT, "brand": "toyota", "carFw": [{"ecu": "eps", "fwVersion": b"1"}],
+                    "safetyConfigs": [{"safetyModel": "toyota", "safetyParam": 73}]})
+  for i in range(seconds * 100):
+    t = int(i * 1e7)
+    add(t, carState={"vEgo": rng.uniform(0, 30), "vCruise": rng.choice([0., 30.])})
+    add(t, controlsState={"vCruiseDEPRECATED": 30., "vCruiseClusterDEPRECATED": 31., "enabledDEPRECATED": True,
+                          "alertText1DEPRECATED": "text", "stateDEPRECATED": "enabled"})
+    add(t + rng.randrange(2), carControl={"actuatorsOutputDEPRECATED": {"accel": rng.uniform(-1, 1)}})
+    if i % 5 == 0:
+      frame_id = 100 + i // 5
+      add(t, modelV2={"frameId": frame_id, "position": {"x": floats(ModelConstants.IDX_N), "y": floats(ModelConstants.IDX_N),
+                                                         "z": floats(ModelConstants.IDX_N)},
+                      "laneLines": [{"x": floats(ModelConstants.IDX_N), "y": floats(ModelConstants.IDX_N)} for _ in range(4)],
+                      "laneLineProbs": floats(4)})
+      add(t, longitudinalPlan={"speeds": floats(ModelConstants.IDX_N), "accels": floats(ModelConstants.IDX_N)})
+      add(t, liveTracksDEPRECATED=[{"trackId": j, "dRel": rng.uniform(0, 100), "yRel": rng.uniform(-5, 5)} for j in range(2)])
+      add(t, liveLocationKalmanDEPRECATED={"orientationNED": xyz(), "velocityDevice": xyz(), "accelerationDevice": xyz(),
+                                           "angularVelocityDevice": xyz(), "inputsOK": True})
+      add(t, driverMonitoringState={"eventsDEPRECATED": [{"name": "driverDistracted"}] * (i % 2)})
+      add(t, onroadEventsDEPRECATED=[{"name": "pcmEnable", "enable": True}, {"name": "steerSaturated", "warning": True}][:i % 3])
+      add(t, roadCameraState={"frameId": frame_id, "timestampEof": t + int(3e7)})
+      add(t, driverCameraState={"frameId": frame_id, "timestampEof": t})
+      # a wide frame without an encoded frame is dropped
+      add(t, wideRoadCameraState={"frameId": frame_id})
+      if i % 15 != 0:
+        add(t + 1, wideRoadEncodeIdx={"frameId": frame_id, "segmentId": frame_id - 100})
+      add(t + 1, roadEncodeIdx={"frameId": frame_id, "segmentId": frame_id - 100})
+    if i % 50 == 0:
+      add(t, deviceState={"freeSpacePercent": 0.5})
+      add(t, pandaStateDEPRECATED={"ignitionLine": True, "alternativeExperience": 1})
+      add(t, managerState={"processes": [{"name": "controlsd"}]})
+      add(t, gpsLocationExternal={"flags": i % 2, "latitude": 32.})
+      add(t, sensorEventsDEPRECATED=[{"acceleration": {"v": floats(3)}, "sensor": 1}, {"gyroUncalibrated": {"v": floats(3)}, "sensor": 5}])
+  return sorted(msgs, key=lambda m: m.logMonoTime)
+
+
+def assert_logs_equal(a, b):
+  assert [m.as_builder().to_bytes() for m in a] == [m.as_builder().to_bytes() for m in b]
+
+
+class TestMigration:
+  @pytest.mark.parametrize("ordered", [True, False])
+  @pytest.mark.parametrize("flags", [(False, False, False), (True, True, True)])
+  def test_matches_reference(self, ordered, flags):
+    migrations = get_migrations(*flags)
+    for seed in range(3):
+      lr = old_log(seed)
+      if not ordered:
+        random.Random(seed).shuffle(lr)
+
+      expected = reference_migrate(lr, migrations)
+      assert_logs_equal(migrate(lr, migrations), expected)
+      assert_logs_equal(list(migrate_iter(iter(lr), migrations)), expected)
+
+  def test_skips_existing_products(self):
+    migrations = get_migrations(True, True, True)
+    lr = old_log(0)
+    # a product in the middle of the log skips its migration for the whole log
+    lr.insert(len(lr) // 2, log.Event.new_message(logMonoTime=lr[len(lr) // 2].logMonoTime, selfdriveState={}).as_reader())
+    lr.insert(len(lr) // 3, log.Event.new_message(logMonoTime=lr[len(lr) // 3].logMonoTime, liveTracks={}).as_reader())
+    assert_logs_equal(migrate(lr, migrations), reference_migrate(lr, migrations))
+
+  @pytest.mark.parametrize("stream, reads", [(False, 1), (True, 2)])
+  def test_log_reads(self, tmp_path, monkeypatch, stream, reads):
+    fn = str(tmp_path / "rlog.zst")
+    save_log(fn, old_log(0))
+    opened = []
+    _open = _LogFileReader._open
+
+    def open_log(self):
+      opened.append(self._fn)
+      return _open(self)
+    monkeypatch.setattr(_LogFileReader, "_open", open_log)
+
+    migrations = get_migrations(True, True, True)
+    assert_logs_equal(list(migrate_iter(LogReader(fn, stream=stream), migrations)), reference_migrate(old_log(0), migrations))
+    # a default LogReader keeps its decoded file, a streaming one decompresses it again on the second pass
+    assert opened == [fn] * reads
@@ -5,7 +5,7 @@ import os
 import sys
 from collections import defaultdict
 from tqdm import tqdm
-from typing import Any
+from typing import Any, cast
 
 from opendbc.car.car_helpers import interface_names
 from openpilot.common.git import get_commit
@@ -13,6 +13,7 @@ from openpilot.tools.lib.openpilotci import get_url, upload_file
 from openpilot.selfdrive.test.process_replay.compare_logs import compare_logs, format_diff
 from openpilot.selfdrive.test.process_replay.process_replay import CONFIGS, PROC_REPLAY_DIR, FAKEDATA, replay_process, \
                                                                    check_most_messages_valid
+from openpilot.selfdrive.test.process_replay.scheduler import ReplayJob, run_jobs
 from openpilot.tools.lib.filereader import FileReader
 from openpilot.tools.lib.logreader import LogReader, save_log
 
@@ -66,6 +67,7 @@ excluded_interfaces = ["mock", "body"]
 BASE_URL = "https://commadataci.blob.core.windows.net/openpilotci/"
 REF_COMMIT_FN = os.path.join(PROC_REPLAY_DIR, "ref_commit")
 EXCLUDED_PROCS = {"modeld", "dmonitoringmodeld"}
+JOB_TIMEOUT = 600
 
 
 def run_test_process(data):
@@ -145,6 +147,8 @@ if __name__ == "__main__":
                       help="Skips testing processes and uploads logs from previous test run")
   parser.add_argument("-j", "--jobs", type=int, default=max(cpu_count - 2, 1),
                       help="Max amount of parallel jobs")
+  parser.add_argument("--timeout", type=int, default=JOB_TIMEOUT,
+                      help="Timeout in seconds for replaying a process on a segment")
   args = parser.parse_args()
 
   tested_procs = set(args.whitelist_procs) - set(args.blacklist_procs)
@@ -177,45 +181,50 @@ if __name__ == "__main__":
     assert len(untested) == 0, f"Cars missing routes: {str(untested)}"
 
   log_paths: defaultdict[str, dict[str, dict[str, str]]] = defaultdict(lambda: defaultdict(dict))
-  with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
-    if not args.upload_only:
+  if not args.upload_only:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
       download_segments = [seg for car, seg in segments if car in tested_cars]
       log_data: dict[str, LogReader] = {}
       p1 = pool.map(get_log_data, download_segments)
       for segment, lr in tqdm(p1, desc="Getting Logs", total=len(download_segments)):
         log_data[segment] = lr
 
-    pool_args: Any = []
-    for car_brand, segment in segments:
-      if car_brand not in tested_cars:
-        continue
-
-      for cfg in CONFIGS:
-        if cfg.proc_name not in tested_procs:
-          continue
-
-        # to speed things up, we only test all segments on card
-        if cfg.proc_name not in ('card', 'controlsd', 'lagd') and car_brand not in ('HYUNDAI', 'TOYOTA'):
-          continue
+  jobs: list[ReplayJob] = []
+  for car_brand, segment in segments:
+    if car_brand not in tested_cars:
+      continue
 
-        cur_log_fn = os.path.join(FAKEDATA, f"{segment}_{cfg.proc_name}_{cur_commit}.zst")
-        if args.update_refs:  # reference logs will not exist if routes were just regenerated
-          ref_log_path = get_url(*segment.rsplit("--", 1,), "rlog.zst")
-        else:
-          ref_log_fn = os.path.join(FAKEDATA, f"{segment}_{cfg.proc_name}_{ref_commit}.zst")
-          ref_log_path = ref_log_fn if os.path.exists(ref_log_fn) else BASE_URL + os.path.basename(ref_log_fn)
-
-        dat = None if args.upload_only else log_data[segment]
-        pool_args.append((segment, cfg, args, cur_log_fn, ref_log_path, dat))
+    for cfg in CONFIGS:
+      if cfg.proc_name not in tested_procs:
+        continue
 
-        log_paths[segment][cfg.proc_name]['ref'] = ref_log_path
-        log_paths[segment][cfg.proc_name]['new'] = cur_log_fn
+      # to speed things up, we only test all segments on card
+      if cfg.proc_name not in ('card', 'controlsd', 'lagd') and car_brand not in ('HYUNDAI', 'TOYOTA'):
+        continue
 
-    results: Any = defaultdict(dict)
-    p2 = pool.map(run_test_process, pool_args)
-    for (segment, proc, result) in tqdm(p2, desc="Running Tests", total=len(pool_args)):
-      if not args.upload_only:
-        results[segment][proc] = result
+      cur_log_fn = os.path.join(FAKEDATA, f"{segment}_{cfg.proc_name}_{cur_commit}.zst")
+      if args.update_refs:  # reference logs will not exist if routes were just regenerated
+        ref_log_path = get_url(*segment.rsplit("--", 1,), "rlog.zst")
+      else:
+        ref_log_fn = os.path.join(FAKEDATA, f"{segment}_{cfg.proc_name}_{ref_commit}.zst")
+        ref_log_path = ref_log_fn if os.path.exists(ref_log_fn) else BASE_URL + os.path.basename(ref_log_fn)
+
+      dat = None if args.upload_only else log_data[segment]
+      jobs.append(ReplayJob((segment, cfg.proc_name), run_test_process, ((segment, cfg, args, cur_log_fn, ref_log_path, dat),), args.timeout))
+
+      log_paths[segment][cfg.proc_name]['ref'] = ref_log_path
+      log_paths[segment][cfg.proc_name]['new'] = cur_log_fn
+
+  # every (segment, process) replay runs in its own process and prefix, a failing replay doesn't stop the others
+  job_results = {res.key: res for res in run_jobs(jobs, args.jobs, desc="Running Tests")}
+  results: Any = defaultdict(dict)
+  for job in jobs:
+    segment, proc = cast(tuple[str, str], job.key)
+    res = job_results[job.key]
+    if args.upload_only:
+      assert res.ok, f"Failed to upload {segment} {proc}:\n{res.error}"
+    else:
+      results[segment][proc] = res.result[2] if res.ok else res.error
 
   diff_short, diff_long, failed = format_diff(results, log_paths, ref_commit)
   if not upload:
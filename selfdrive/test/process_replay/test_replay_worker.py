@@ -0,0 +1,69 @@
+import numpy as np
+
+from cereal import log
+from opendbc.car.toyota.values import CAR as TOYOTA
+from openpilot.selfdrive.test.process_replay.compare_logs import compare_logs
+from openpilot.selfdrive.test.process_replay.process_replay import ReplayWorker, get_process_config, replay_process
+
+FINGERPRINT = TOYOTA.TOYOTA_COROLLA_TSS2
+
+
+def xyz(rng: np.random.Generator, scale: float, std: float) -> dict:
+  x, y, z = rng.normal(0, scale, 3).tolist()
+  return {"x": x, "y": y, "z": z, "xStd": std, "yStd": std, "zStd": std, "valid": True}
+
+
+def synthetic_log(seed: int, seconds: int = 10) -> list:
+  # driving at highway speed with small steering, every service the replayed python daemons subscribe to
+  rng = np.random.default_rng(seed)
+  msgs = []
+
+  def add(t: int, **kwargs) -> None:
+    msgs.append(log.Event.new_message(logMonoTime=t, valid=True, **kwargs).as_reader())
+
+  for i in range(seconds * 100):
+    t = int(i * 1e7)
+    v_ego = float(25 + rng.normal())
+    curvature = float(rng.normal(0, 1e-3))
+    add(t, carState={"vEgo": v_ego, "steeringAngleDeg": curvature * 1000, "standstill": False})
+    add(t + 1, carControl={"enabled": True, "latActive": True, "actuators": {"curvature": curvature, "torque": curvature * 100}})
+    add(t + 2, carOutput={"actuatorsOutput": {"curvature": curvature, "torque": curvature * 100}})
+    add(t + 3, controlsState={"curvature": curvature, "desiredCurvature": curvature})
+    if i % 5 == 0:
+      add(t + 4, cameraOdometry={
+        "trans": [v_ego * 0.05, *rng.normal(0, 0.01, 2).tolist()],
+        "rot": rng.normal(0, 0.001, 3).tolist(),
+        "transStd": [0.01] * 3,
+        "rotStd": [0.001] * 3,
+      })
+      add(t + 5, livePose={"orientationNED": xyz(rng, 0.01, 0.01), "velocityDevice": {**xyz(rng, 0.1, 0.1), "x": v_ego},
+                           "accelerationDevice": xyz(rng, 0.1, 0.1), "angularVelocityDevice": {**xyz(rng, 1e-3, 1e-3), "z": curvature * v_ego},
+                           "inputsOK": True, "posenetOK": True, "sensorsOK": True})
+      add(t + 6, modelV2={"frameId": i // 5})
+      add(t + 7, liveTracks={})
+    if i % 25 == 0:
+      add(t + 8, liveCalibration={"calStatus": "calibrated", "rpyCalib": [0., 0., 0.], "height": [1.2]})
+      add(t + 9, liveDelay={"lateralDelay": 0.2, "status": "estimated"})
+  return msgs
+
+
+class TestReplayWorker:
+  def test_matches_replay_process(self):
+    cfg = get_process_config("calibrationd")
+    lrs = [synthetic_log(seed) for seed in range(3)]
+    ref_logs = [replay_process(cfg, lr, fingerprint=FINGERPRINT, disable_progress=True) for lr in lrs]
+
+    server_pids = set()
+    with ReplayWorker(cfg) as worker:
+      container = worker.containers[0]
+      for lr, ref_msgs in zip(lrs, ref_logs, strict=True):
+        msgs = worker.replay(lr, fingerprint=FINGERPRINT, disable_progress=True)
+        assert len(msgs) == len(ref_msgs) > 0
+        assert compare_logs(ref_msgs, msgs, cfg.ignore, tolerance=cfg.tolerance) == []
+
+        # the process under test is gone, the fork server it was forked from is kept
+        assert container.process.proc is None
+        assert container.fork_server is not None and container.fork_server.proc.is_alive()
+        server_pids.add(container.fork_server.proc.pid)
+    assert len(server_pids) == 1
+    assert container.fork_server is None
@@ -0,0 +1,104 @@
+import os
+import subprocess
+import threading
+import time
+import pytest
+
+from openpilot.selfdrive.test.process_replay.scheduler import ReplayJob, run_jobs
+
+
+def ok_job(x):
+  return x * 2, os.environ["OPENPILOT_PREFIX"]
+
+
+def raising_job():
+  raise ValueError("bad segment")
+
+
+def exiting_job():
+  os._exit(3)
+
+
+def unpicklable_job():
+  return threading.Lock()
+
+
+def hanging_job(pid_file):
+  # a child in the job's process group, like a daemon under test
+  proc = subprocess.Popen(["sleep", "100"])
+  with open(pid_file, "w") as f:
+    f.write(str(proc.pid))
+  time.sleep(100)
+
+
+def timed_job(duration):
+  start = time.monotonic()
+  time.sleep(duration)
+  return start, time.monotonic()
+
+
+def process_alive(pid: int) -> bool:
+  try:
+    with open(f"/proc/{pid}/stat") as f:
+      return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+  except FileNotFoundError:
+    return False
+
+
+def run(jobs, workers=2):
+  return {res.key: res for res in run_jobs(jobs, workers, disable_progress=True)}
+
+
+class TestScheduler:
+  def test_ok(self):
+    results = run([ReplayJob(i, ok_job, (i,)) for i in range(4)])
+    assert sorted(results) == [0, 1, 2, 3]
+    for i, res in results.items():
+      assert res.ok and not res.timed_out
+      assert res.result[0] == i * 2
+      assert res.duration > 0
+
+    # every job gets its own prefix
+    assert len({res.result[1] for res in results.values()}) == 4
+
+  def test_exception(self):
+    res = run([ReplayJob("a", raising_job)])["a"]
+    assert not res.ok and not res.timed_out
+    assert res.result is None
+    assert "ValueError: bad segment" in res.error
+
+  def test_exit(self):
+    res = run([ReplayJob("a", exiting_job)])["a"]
+    assert not res.ok
+    assert res.error == "job exited with code 3"
+
+  def test_unpicklable_result(self):
+    res = run([ReplayJob("a", unpicklable_job)])["a"]
+    assert not res.ok
+    assert "lock" in res.error
+
+  def test_timeout(self, tmp_path):
+    pid_file = str(tmp_path / "pid")
+    start = time.monotonic()
+    results = run([ReplayJob("hang", hanging_job, (pid_file,), timeout=1.), ReplayJob("ok", ok_job, (1,))])
+    assert time.monotonic() - start < 10
+
+    assert results["ok"].ok
+    res = results["hang"]
+    assert res.timed_out and not res.ok
+    assert res.error == "timed out after 1.0s"
+    assert res.duration >= 1.
+
+    # the job's whole process group is killed
+    with open(pid_file) as f:
+      pid = int(f.read())
+    assert not process_alive(pid)
+
+  @pytest.mark.parametrize("workers", [1, 3])
+  def test_workers(self, workers):
+    results = run([ReplayJob(i, timed_job, (0.3,)) for i in range(6)], workers)
+    assert all(res.ok for res in results.values())
+
+    intervals = [res.result for res in results.values()]
+    max_running = max(sum(s <= t < e for s, e in intervals) for t, _ in intervals)
+    assert max_running == workers
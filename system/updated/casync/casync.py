@@ -13,6 +13,7 @@ from typing import IO
 
 import requests
 from Crypto.Hash import SHA512
+from openpilot.common.download_cache import DownloadCache, get_download_cache
 from openpilot.system.updated.casync import tar
 from openpilot.system.updated.casync.common import create_casync_tar_package
 
@@ -63,19 +64,21 @@ class FileChunkReader(BinaryChunkReader):
 class RemoteChunkReader(ChunkReader):
   """Reads lzma compressed chunks from a remote store"""
 
-  def __init__(self, url: str) -> None:
+  def __init__(self, url: str, cache: DownloadCache | None = None) -> None:
     super().__init__()
     self.url = url
+    self.cache = cache
     self.session = requests.Session()
 
   def read(self, chunk: Chunk) -> bytes:
     sha_hex = chunk.sha.hex()
     url = os.path.join(self.url, sha_hex[:4], sha_hex + ".cacnk")
 
-    if os.path.isfile(url):
+    contents = self.cache.get(sha_hex) if self.cache is not None else None
+    if contents is None and os.path.isfile(url):
       with open(url, 'rb') as f:
         contents = f.read()
-    else:
+    elif contents is None:
       for i in range(CHUNK_DOWNLOAD_RETRIES):
         try:
           resp = self.session.get(url, timeout=CHUNK_DOWNLOAD_TIMEOUT)
@@ -87,6 +90,8 @@ class RemoteChunkReader(ChunkReader):
 
       resp.raise_for_status()
       contents = resp.content
+      if self.cache is not None:
+        self.cache.put(sha_hex, contents)
 
     decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_AUTO)
     return decompressor.decompress(contents)
@@ -229,9 +234,13 @@ def print_stats(stats: dict[str, int]):
 def extract_simple(caibx_path, out_path, store_path):
   # (name, callback, chunks)
   target = parse_caibx(caibx_path)
+  if store_path.startswith(("http://", "https://")):
+    # downloaded chunks are kept in the download cache for repeated extractions
+    reader: ChunkReader = RemoteChunkReader(store_path, get_download_cache())
+  else:
+    reader = FileChunkReader(store_path)
   sources = [
-    # (store_path, RemoteChunkReader(store_path), build_chunk_dict(target)),
-    (store_path, FileChunkReader(store_path), build_chunk_dict(target)),
+    (store_path, reader, build_chunk_dict(target)),
   ]
 
   return extract(target, sources, out_path)
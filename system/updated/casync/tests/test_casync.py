@@ -1,9 +1,14 @@
+import hashlib
+import http.server
+import lzma
 import pytest
 import os
+import threading
 import pathlib
 import tempfile
 import subprocess
 
+from openpilot.common.download_cache import DownloadCache
 from openpilot.system.updated.casync import casync
 from openpilot.system.updated.casync import tar
 
@@ -13,6 +18,45 @@ from openpilot.system.updated.casync import tar
 LOOPBACK = os.environ.get('LOOPBACK', None)
 
 
+class ChunkStoreHandler(http.server.BaseHTTPRequestHandler):
+  CHUNKS: dict[str, bytes] = {}
+  requests: list[str] = []
+
+  def do_GET(self):
+    self.requests.append(self.path)
+    dat = self.CHUNKS.get(self.path)
+    self.send_response(200 if dat is not None else 404)
+    self.end_headers()
+    if dat is not None:
+      self.wfile.write(dat)
+
+
+def test_remote_chunk_reader_cache():
+  contents = bytes(range(256)) * 64
+  sha = hashlib.sha512(contents).digest()[:32]
+  ChunkStoreHandler.CHUNKS = {f"/{sha.hex()[:4]}/{sha.hex()}.cacnk": lzma.compress(contents)}
+  ChunkStoreHandler.requests = []
+  chunk = casync.Chunk(sha, 0, len(contents))
+
+  server = http.server.HTTPServer(('127.0.0.1', 0), ChunkStoreHandler)
+  t = threading.Thread(target=server.serve_forever)
+  t.start()
+  try:
+    with tempfile.TemporaryDirectory() as tmpdir:
+      cache = DownloadCache(tmpdir, max_bytes=1024 * 1024)
+      for _ in range(2):
+        reader = casync.RemoteChunkReader(f"http://127.0.0.1:{server.server_port}", cache)
+        assert reader.read(chunk) == contents
+  finally:
+    server.shutdown()
+    server.server_close()
+    t.join()
+
+    # the second reader is served from the cache
+    assert len(ChunkStoreHandler.requests) == 1
+    assert cache.stats["hits"] == 1
+
+
 @pytest.mark.skip("not used yet")
 class TestCasync:
   @classmethod
@@ -1,3 +1,5 @@
+import io
+import mmap
 import os
 import posixpath
 import socket
@@ -5,7 +7,7 @@ from functools import cache
 from openpilot.common.retry import retry
 from urllib.parse import urlparse
 
-from openpilot.tools.lib.url_file import URLFile
+from openpilot.tools.lib.url_file import URLFile, hash_256
 
 DATA_ENDPOINT = os.getenv("DATA_ENDPOINT", "http://data-raw.comma.internal/")
 
@@ -34,6 +36,15 @@ def resolve_name(fn):
   return fn
 
 
+def file_cache_key(fn: str) -> str:
+  fn = resolve_name(fn)
+  if fn.startswith(("http://", "https://")):
+    return hash_256(fn)
+  # local files aren't immutable, invalidate cached data when they change
+  st = os.stat(fn)
+  return hash_256(f"{os.path.abspath(fn)}:{st.st_size}:{st.st_mtime_ns}")
+
+
 @cache
 def file_exists(fn):
   fn = resolve_name(fn)
@@ -47,3 +58,15 @@ def FileReader(fn, debug=False):
   if fn.startswith(("http://", "https://")):
     return URLFile(fn, debug=debug)
   return open(fn, "rb")
+
+
+def read_buffer(f):
+  """Reads a whole file opened with FileReader without an extra copy, local files are memory mapped."""
+  if isinstance(f, URLFile):
+    return f.read_view()
+  try:
+    if os.fstat(f.fileno()).st_size == 0:
+      return b""
+  except io.UnsupportedOperation:
+    return f.read()
+  return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
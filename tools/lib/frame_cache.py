@@ -0,0 +1,108 @@
+import contextlib
+import mmap
+import os
+from functools import cache
+
+import numpy as np
+
+from openpilot.common.file_helpers import atomic_write_in_dir
+from openpilot.system.hardware.hw import DEFAULT_DOWNLOAD_CACHE_ROOT
+
+DEFAULT_CACHE_SIZE_MB = 4 * 1024
+SHM_ROOT = "/dev/shm"
+
+
+class SharedFrameCache:
+  """Decoded frames in memory mapped files shared by all processes. The least recently used frames are evicted over max_bytes."""
+  def __init__(self, root: str, max_bytes: int):
+    self.root = root
+    self.stats = {"hits": 0, "misses": 0, "evictions": 0, "evicted_bytes": 0, "write_errors": 0}
+    self._written_bytes = 0
+    os.makedirs(self.root, exist_ok=True)
+
+    # /dev/shm can be much smaller than the budget, e.g. 64MB in docker. frames already cached count as free
+    fs = os.statvfs(self.root)
+    cached_bytes = sum(st.st_size for _, st in self._entries())
+    self.max_bytes = min(max_bytes, fs.f_bavail * fs.f_frsize + cached_bytes)
+
+  def _path(self, key: str, fidx: int) -> str:
+    return os.path.join(self.root, f"{key}_{fidx}")
+
+  def get(self, key: str, fidx: int, shape: tuple[int, ...]) -> np.ndarray | None:
+    path = self._path(key, fidx)
+    try:
+      with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # mtime tracks last use for eviction
+        os.utime(f.fileno())
+    except FileNotFoundError:
+      self.stats["misses"] += 1
+      return None
+
+    self.stats["hits"] += 1
+    return np.frombuffer(mm, dtype=np.uint8).reshape(shape)
+
+  def put(self, key: str, fidx: int, frame: np.ndarray) -> None:
+    path = self._path(key, fidx)
+    if os.path.exists(path):
+      return
+
+    tmp_name = None
+    try:
+      with atomic_write_in_dir(path, mode="wb", overwrite=True) as f:
+        tmp_name = f.name
+        f.write(np.ascontiguousarray(frame).data)
+    except OSError:
+      # out of space, the frame is used without caching it
+      if tmp_name is not None:
+        with contextlib.suppress(FileNotFoundError):
+          os.remove(tmp_name)
+      self.stats["write_errors"] += 1
+      return
+
+    # a directory scan per frame is too slow, evict after a tenth of the budget was written
+    self._written_bytes += frame.nbytes
+    if self._written_bytes > self.max_bytes // 10:
+      self._written_bytes = 0
+      self.evict()
+
+  def _entries(self) -> list[tuple[os.DirEntry, os.stat_result]]:
+    # skip in-progress atomic writes
+    entries = []
+    for e in os.scandir(self.root):
+      try:
+        if e.is_file() and not e.name.startswith("tmp"):
+          entries.append((e, e.stat()))
+      except FileNotFoundError:
+        continue  # evicted by another process
+    return entries
+
+  def evict(self) -> None:
+    entries = self._entries()
+    total = sum(st.st_size for _, st in entries)
+    for e, st in sorted(entries, key=lambda x: x[1].st_mtime):
+      if total <= self.max_bytes:
+        break
+      try:
+        os.remove(e.path)
+      except FileNotFoundError:
+        continue
+      total -= st.st_size
+      self.stats["evictions"] += 1
+      self.stats["evicted_bytes"] += st.st_size
+
+
+@cache
+def _get_cache(root: str, max_bytes: int) -> SharedFrameCache:
+  return SharedFrameCache(root, max_bytes)
+
+
+def get_frame_cache() -> SharedFrameCache | None:
+  """Returns the shared frame cache if enabled with FRAME_CACHE=1, its size is set with FRAME_CACHE_SIZE_MB.
+  Frames are kept in /dev/shm when available. Frames are keyed by content, so the cache is shared by all
+  processes regardless of their OPENPILOT_PREFIX, and stays within its size across runs."""
+  if not int(os.getenv("FRAME_CACHE", "0")):
+    return None
+  max_bytes = int(os.getenv("FRAME_CACHE_SIZE_MB", str(DEFAULT_CACHE_SIZE_MB))) * 1024 * 1024
+  root = SHM_ROOT if os.path.isdir(SHM_ROOT) else DEFAULT_DOWNLOAD_CACHE_ROOT
+  return _get_cache(os.path.join(root, "openpilot_frame_cache"), max_bytes)
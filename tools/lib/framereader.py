@@ -1,11 +1,20 @@
+import contextlib
 import os
 import subprocess
 import json
-from collections.abc import Iterator
+import threading
+import zipfile
+from collections.abc import Generator, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
 from collections import OrderedDict
 
 import numpy as np
-from openpilot.tools.lib.filereader import FileReader, resolve_name
+from openpilot.common.file_helpers import atomic_write_in_dir
+from openpilot.system.hardware.hw import Paths
+from openpilot.tools.lib.filereader import FileReader, file_cache_key, resolve_name
+from openpilot.tools.lib.frame_cache import get_frame_cache
+from openpilot.tools.lib.route import Route
+from openpilot.tools.lib.url_file import hash_256
 from openpilot.tools.lib.exceptions import DataUnreadableError
 from openpilot.tools.lib.vidindex import hevc_index
 
@@ -14,20 +23,42 @@ HEVC_SLICE_B = 0
 HEVC_SLICE_P = 1
 HEVC_SLICE_I = 2
 
+# size of the reads feeding a streaming decoder
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# bump when the cached index layout changes
+VIDEO_INDEX_VERSION = 1
+
+# segment videos indexed in parallel by RouteFrameReader
+INDEX_WORKERS = 8
+
+# camera -> (Route method returning its videos, encode index service)
+ROUTE_CAMERAS = {
+  "fcamera": ("camera_paths", "roadEncodeIdx"),
+  "ecamera": ("ecamera_paths", "wideRoadEncodeIdx"),
+  "dcamera": ("dcamera_paths", "driverEncodeIdx"),
+}
+
 
 class LRUCache:
-  def __init__(self, capacity: int):
+  def __init__(self, capacity: int, max_bytes: int|None = None):
     self._cache: OrderedDict = OrderedDict()
     self.capacity = capacity
+    self.max_bytes = max_bytes
+    self.nbytes = 0
 
   def __getitem__(self, key):
     self._cache.move_to_end(key)
     return self._cache[key]
 
   def __setitem__(self, key, value):
+    if key in self._cache:
+      self.nbytes -= getattr(self._cache.pop(key), "nbytes", 0)
     self._cache[key] = value
-    if len(self._cache) > self.capacity:
-        self._cache.popitem(last=False)
+    self.nbytes += getattr(value, "nbytes", 0)
+    # always keep the newest entry, even if it's over budget on its own
+    while len(self._cache) > self.capacity or (self.max_bytes is not None and self.nbytes > self.max_bytes and len(self._cache) > 1):
+      self.nbytes -= getattr(self._cache.popitem(last=False)[1], "nbytes", 0)
 
   def __contains__(self, key):
     return key in self._cache
@@ -42,7 +73,7 @@ def assert_hvec(fn: str) -> None:
     if 'hevc' not in fn:
       raise NotImplementedError(fn)
 
-def decompress_video_data(rawdat, w, h, pix_fmt="rgb24", vid_fmt='hevc') -> np.ndarray:
+def ffmpeg_decode_args(pix_fmt="rgb24", vid_fmt='hevc', crop=None, scale=None) -> list[str]:
   threads = os.getenv("FFMPEG_THREADS", "0")
   args = ["ffmpeg", "-v", "quiet",
           "-threads", threads,
@@ -50,20 +81,70 @@ def decompress_video_data(rawdat, w, h, pix_fmt="rgb24", vid_fmt='hevc') -> np.n
           "-vsync", "0",
           "-f", vid_fmt,
           "-flags2", "showall",
-          "-i", "-",
-          "-f", "rawvideo",
-          "-pix_fmt", pix_fmt,
-          "-"]
-  dat = subprocess.check_output(args, input=rawdat)
+          "-i", "-"]
+  # crop and scale inside the decoder, so only the output frames are converted and piped
+  filters = []
+  if crop is not None:
+    x, y, w, h = crop
+    filters.append(f"crop={w}:{h}:{x}:{y}")
+  if scale is not None:
+    filters.append(f"scale={scale[0]}:{scale[1]}")
+  if filters:
+    args += ["-vf", ",".join(filters)]
+  return args + ["-f", "rawvideo",
+                 "-pix_fmt", pix_fmt,
+                 "-"]
+
+def output_size(w, h, crop=None, scale=None) -> tuple[int, int]:
+  if crop is not None:
+    w, h = crop[2], crop[3]
+  if scale is not None:
+    w, h = scale
+  return w, h
 
-  ret: np.ndarray
+def frame_shape(w, h, pix_fmt="rgb24") -> tuple[int, ...]:
   if pix_fmt == "rgb24":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, h, w, 3)
+    return (h, w, 3)
   elif pix_fmt in ["nv12", "yuv420p"]:
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, (h*w*3//2))
-  else:
-    raise NotImplementedError(f"Unsupported pixel format: {pix_fmt}")
-  return ret
+    return (h*w*3//2,)
+  elif pix_fmt == "gray":
+    return (h, w)
+  raise NotImplementedError(f"Unsupported pixel format: {pix_fmt}")
+
+def decompress_video_data(rawdat, w, h, pix_fmt="rgb24", vid_fmt='hevc', crop=None, scale=None) -> np.ndarray:
+  shape = frame_shape(*output_size(w, h, crop, scale), pix_fmt)
+  dat = subprocess.check_output(ffmpeg_decode_args(pix_fmt, vid_fmt, crop, scale), input=rawdat)
+  return np.frombuffer(dat, dtype=np.uint8).reshape(-1, *shape)
+
+def stream_video_data(chunks: Iterable[bytes], w, h, pix_fmt="rgb24", vid_fmt='hevc', crop=None, scale=None) -> Generator[np.ndarray, None, None]:
+  """Decodes raw video chunks with a single ffmpeg process, frames are yielded as soon as they're decoded."""
+  shape = frame_shape(*output_size(w, h, crop, scale), pix_fmt)
+  size = int(np.prod(shape))
+  args = ffmpeg_decode_args(pix_fmt, vid_fmt, crop, scale)
+  proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+  assert proc.stdin is not None and proc.stdout is not None
+
+  def feed():
+    try:
+      for chunk in chunks:
+        proc.stdin.write(chunk)
+      proc.stdin.close()
+    except (BrokenPipeError, ValueError):
+      pass  # decoder was stopped early
+
+  feeder = threading.Thread(target=feed, daemon=True)
+  feeder.start()
+  try:
+    while len(dat := proc.stdout.read(size)) == size:
+      yield np.frombuffer(dat, dtype=np.uint8).reshape(shape)
+    if proc.wait() != 0:
+      raise subprocess.CalledProcessError(proc.returncode, args)
+  finally:
+    if proc.poll() is None:
+      proc.kill()
+    proc.wait()
+    feeder.join()
+    proc.stdout.close()
 
 def ffprobe(fn, fmt=None):
   fn = resolve_name(fn)
@@ -87,26 +168,65 @@ def get_index_data(fn: str, index_data: dict|None = None):
   stream = index_data["probe"]["streams"][0]
   return index_data["index"], index_data["global_prefix"], stream["width"], stream["height"]
 
-def get_video_index(fn):
+def video_index_path(fn: str) -> str|None:
+  # opt-in like the download cache, cached indexes are never evicted
+  if not int(os.environ.get("FILEREADER_CACHE", "0")):
+    return None
+  return os.path.join(Paths.download_cache_root(), f"{file_cache_key(fn)}_video_index_v{VIDEO_INDEX_VERSION}.npz")
+
+def load_video_index(path: str) -> dict|None:
+  try:
+    with open(path, "rb") as f, np.load(f) as dat:
+      return {
+        'index': dat['index'],
+        'global_prefix': dat['global_prefix'].tobytes(),
+        'probe': json.loads(str(dat['probe'])),
+      }
+  except FileNotFoundError:
+    return None
+  except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+    # truncated or corrupt, removed so it's rebuilt
+    with contextlib.suppress(FileNotFoundError):
+      os.remove(path)
+    return None
+
+def save_video_index(path: str, index_data: dict) -> None:
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with atomic_write_in_dir(path, mode="wb", overwrite=True) as f:
+    np.savez(f, index=index_data['index'], global_prefix=np.frombuffer(index_data['global_prefix'], dtype=np.uint8),
+             probe=np.array(json.dumps(index_data['probe'])))
+
+def get_video_index(fn, cache: bool = True):
+  # the index of a video file never changes, reuse it across runs with FILEREADER_CACHE=1
+  path = video_index_path(fn) if cache else None
+  if path is not None and (index_data := load_video_index(path)) is not None:
+    return index_data
+
   assert_hvec(fn)
   frame_types, dat_len, prefix = hevc_index(fn)
   index = np.array(frame_types + [(0xFFFFFFFF, dat_len)], dtype=np.uint32)
   probe = ffprobe(fn, "hevc")
-  return {
+  index_data = {
     'index': index,
     'global_prefix': prefix,
     'probe': probe
   }
+  if path is not None:
+    save_video_index(path, index_data)
+  return index_data
 
 
 class FfmpegDecoder:
   def __init__(self, fn: str, index_data: dict|None = None,
-               pix_fmt: str = "rgb24"):
+               pix_fmt: str = "rgb24", crop: tuple[int, int, int, int]|None = None, scale: tuple[int, int]|None = None):
     self.fn = fn
-    self.index, self.prefix, self.w, self.h = get_index_data(fn, index_data)
+    self.index, self.prefix, self.src_w, self.src_h = get_index_data(fn, index_data)
     self.frame_count = len(self.index) - 1          # sentinel row at the end
     self.iframes = np.where(self.index[:, 0] == HEVC_SLICE_I)[0]
     self.pix_fmt = pix_fmt
+    # optional (x, y, w, h) crop of the source frame, then (w, h) scale, w and h are the size of the output frames
+    self.crop, self.scale = crop, scale
+    self.w, self.h = output_size(self.src_w, self.src_h, crop, scale)
 
   def _gop_bounds(self, frame_idx: int):
     f_b = frame_idx
@@ -118,56 +238,269 @@ class FfmpegDecoder:
     return f_b, f_e, self.index[f_b, 1], self.index[f_e, 1]
 
   def _decode_gop(self, raw: bytes) -> Iterator[np.ndarray]:
-    yield from decompress_video_data(raw, self.w, self.h, self.pix_fmt)
+    yield from decompress_video_data(raw, self.src_w, self.src_h, self.pix_fmt, crop=self.crop, scale=self.scale)
+
+  def decode_gop(self, frame_idx: int) -> tuple[int, np.ndarray]:
+    """Decodes the whole GOP containing frame_idx, returns the index of its first frame and its frames."""
+    f_b, _, off_b, off_e = self._gop_bounds(frame_idx)
+    with FileReader(self.fn) as f:
+      f.seek(off_b)
+      raw = self.prefix + f.read(off_e - off_b)
+    return f_b, decompress_video_data(raw, self.src_w, self.src_h, self.pix_fmt, crop=self.crop, scale=self.scale)
 
   def get_gop_start(self, frame_idx: int):
     return self.iframes[np.searchsorted(self.iframes, frame_idx, side="right") - 1]
 
+  def _raw_chunks(self, off_b: int, off_e: int) -> Iterator[bytes]:
+    yield self.prefix
+    with FileReader(self.fn) as f:
+      f.seek(off_b)
+      while off_b < off_e:
+        chunk = f.read(min(STREAM_CHUNK_SIZE, off_e - off_b))
+        if not chunk:
+          break
+        off_b += len(chunk)
+        yield chunk
+
   def get_iterator(self, start_fidx: int = 0, end_fidx: int|None = None,
-                   frame_skip: int = 1) -> Iterator[tuple[int, np.ndarray]]:
+                   frame_skip: int = 1) -> Generator[tuple[int, np.ndarray], None, None]:
     end_fidx = end_fidx or self.frame_count
-    fidx = start_fidx
-    while fidx < end_fidx:
-      f_b, f_e, off_b, off_e = self._gop_bounds(fidx)
-      with FileReader(self.fn) as f:
-        f.seek(off_b)
-        raw = self.prefix + f.read(off_e - off_b)
-      # number of frames to discard inside this GOP before the wanted one
-      for i, frm in enumerate(decompress_video_data(raw, self.w, self.h, self.pix_fmt)):
+    if start_fidx >= end_fidx:
+      return
+
+    # one decoder for every GOP from the one containing start_fidx to the one containing the last frame
+    f_b, _, off_b, _ = self._gop_bounds(start_fidx)
+    off_e = self._gop_bounds(end_fidx - 1)[3]
+    raw_chunks = self._raw_chunks(off_b, off_e)
+    with contextlib.closing(stream_video_data(raw_chunks, self.src_w, self.src_h, self.pix_fmt, crop=self.crop, scale=self.scale)) as frames:
+      for i, frm in enumerate(frames):
         fidx = f_b + i
         if fidx >= end_fidx:
           return
         elif fidx >= start_fidx and (fidx - start_fidx) % frame_skip == 0:
           yield fidx, frm
-      fidx += 1
 
 def FrameIterator(fn: str, index_data: dict|None=None,
                         pix_fmt: str = "rgb24",
-                        start_fidx:int=0, end_fidx=None, frame_skip:int=1) -> Iterator[np.ndarray]:
-  dec = FfmpegDecoder(fn, pix_fmt=pix_fmt, index_data=index_data)
+                        start_fidx:int=0, end_fidx=None, frame_skip:int=1,
+                        crop: tuple[int, int, int, int]|None = None, scale: tuple[int, int]|None = None) -> Iterator[np.ndarray]:
+  dec = FfmpegDecoder(fn, pix_fmt=pix_fmt, index_data=index_data, crop=crop, scale=scale)
   for _, frame in dec.get_iterator(start_fidx=start_fidx, end_fidx=end_fidx, frame_skip=frame_skip):
     yield frame
 
 class FrameReader:
   def __init__(self, fn: str, index_data: dict|None = None,
-               cache_size: int = 30, pix_fmt: str = "rgb24"):
-    self.decoder = FfmpegDecoder(fn, index_data, pix_fmt)
+               cache_size: int = 30, pix_fmt: str = "rgb24", prefetch: int = 0, cache_bytes: int|None = None,
+               crop: tuple[int, int, int, int]|None = None, scale: tuple[int, int]|None = None):
+    self.decoder = FfmpegDecoder(fn, index_data, pix_fmt, crop, scale)
     self.iframes = self.decoder.iframes
-    self._cache: LRUCache = LRUCache(cache_size)
+    self._cache: LRUCache = LRUCache(cache_size, cache_bytes)
     self.w, self.h, self.frame_count, = self.decoder.w, self.decoder.h, self.decoder.frame_count
     self.pix_fmt = pix_fmt
 
-    self.it: Iterator[tuple[int, np.ndarray]] | None = None
+    # decoded frames shared with other readers of the same video, see frame_cache.get_frame_cache
+    self._frame_cache = get_frame_cache()
+    self._frame_key = hash_256(f"{file_cache_key(fn)}:{pix_fmt}:{crop}:{scale}") if self._frame_cache is not None else ""
+    self._frame_shape = frame_shape(self.w, self.h, pix_fmt)
+
+    self.it: Generator[tuple[int, np.ndarray], None, None] | None = None
     self.fidx = -1
 
+    # number of GOPs after the requested one that are decoded ahead in parallel, 0 decodes on demand
+    self.prefetch = prefetch
+    self._pool = ThreadPoolExecutor(max_workers=prefetch + 1) if prefetch > 0 else None
+    self._gops: dict[int, Future] = {}
+
   def get(self, fidx:int):
     if fidx in self._cache:  # If frame is cached, return it
       return self._cache[fidx]
+    if self._frame_cache is not None and (frame := self._frame_cache.get(self._frame_key, fidx, self._frame_shape)) is not None:
+      self._cache[fidx] = frame
+      return frame
+    if self._pool is not None:
+      return self._get_prefetched(fidx)
     read_start = self.decoder.get_gop_start(fidx)
-    if not self.it or fidx < self.fidx or read_start != self.decoder.get_gop_start(self.fidx):  # If the frame is in a different GOP, reset the iterator
+    # keep decoding if the frame is in the current or next GOP, otherwise seek by resetting the iterator
+    gops_ahead = np.searchsorted(self.iframes, fidx, side="right") - np.searchsorted(self.iframes, self.fidx, side="right")
+    if not self.it or fidx < self.fidx or gops_ahead > 1:
+      if self.it is not None:
+        self.it.close()
       self.it = self.decoder.get_iterator(read_start)
       self.fidx = -1
     while self.fidx < fidx:
       self.fidx, frame = next(self.it)
-      self._cache[self.fidx] = frame
+      self._store(self.fidx, frame)
     return self._cache[fidx]
+
+  def _store(self, fidx: int, frame: np.ndarray) -> None:
+    self._cache[fidx] = frame
+    if self._frame_cache is not None:
+      self._frame_cache.put(self._frame_key, fidx, frame)
+
+  def close(self) -> None:
+    if self.it is not None:
+      self.it.close()
+      self.it = None
+    if self._pool is not None:
+      self._pool.shutdown(wait=False, cancel_futures=True)
+
+  def _prefetch_gops(self, fidx: int) -> int:
+    assert self._pool is not None
+    f_b: int = self.decoder._gop_bounds(fidx)[0]
+
+    # decode the GOP of fidx and the next ones in parallel, GOPs that are no longer ahead are dropped
+    gops: dict[int, Future] = {}
+    gop_start = f_b
+    while len(gops) <= self.prefetch and gop_start < self.frame_count:
+      gops[gop_start] = self._gops.pop(gop_start) if gop_start in self._gops else self._pool.submit(self.decoder.decode_gop, gop_start)
+      gop_start = self.decoder._gop_bounds(gop_start)[1]
+    for future in self._gops.values():
+      future.cancel()
+    self._gops = gops
+    return f_b
+
+  def _get_prefetched(self, fidx: int):
+    f_b = self._prefetch_gops(fidx)
+    _, frames = self._gops[f_b].result()
+    for i, frame in enumerate(frames):
+      self._store(f_b + i, frame)
+    return frames[fidx - f_b]
+
+
+class RouteFrameReader:
+  """Frames of one camera across all segments of a route, addressed by (segment, frame), by global frame index,
+  or by frameId and timestamp when the encode indexes of the route are given."""
+  def __init__(self, camera_paths: list[str|None], encode_idxs: Iterable|None = None, prefetch: int = 0, **kwargs):
+    self.camera_paths = camera_paths
+    self.prefetch = prefetch
+    self._kwargs = dict(kwargs, prefetch=prefetch)
+    self._pool = ThreadPoolExecutor(max_workers=INDEX_WORKERS)
+    self._readers: dict[int, Future[FrameReader]] = {}
+    self._seg_offsets: np.ndarray|None = None
+    self._frame_segments: np.ndarray|None = None
+
+    # rows of (frameId, segmentNum, segmentId, timestampSof) sorted by timestampSof
+    self._encode_idx = np.zeros((0, 4), dtype=np.int64)
+    self._frame_id_base = 0
+    self._frame_id_rows = np.zeros(0, dtype=np.int64)
+    if encode_idxs is not None:
+      self._set_encode_idxs(encode_idxs)
+
+  @classmethod
+  def from_route(cls, route: Route|str, camera: str = "fcamera", lr: Iterable|None = None, **kwargs) -> 'RouteFrameReader':
+    """camera is one of ROUTE_CAMERAS, lr are the route's messages used for frameId and timestamp lookups."""
+    if isinstance(route, str):
+      route = Route(route)
+    paths_fn, service = ROUTE_CAMERAS[camera]
+    encode_idxs = None
+    if lr is not None:
+      encode_idxs = (getattr(m, service) for m in lr if m.which() == service)
+    return cls(getattr(route, paths_fn)(), encode_idxs, **kwargs)
+
+  def _set_encode_idxs(self, encode_idxs: Iterable) -> None:
+    rows = [(e.frameId, e.segmentNum, e.segmentId, e.timestampSof) for e in encode_idxs if e.type == 'fullHEVC']
+    encode_idx = np.array(rows, dtype=np.int64).reshape(-1, 4)
+    self._encode_idx = encode_idx[np.argsort(encode_idx[:, 3], kind="stable")]
+    if len(self._encode_idx):
+      frame_ids = self._encode_idx[:, 0]
+      self._frame_id_base = int(frame_ids.min())
+      # dense table for frameId -> row, -1 for dropped frames
+      self._frame_id_rows = np.full(int(frame_ids.max()) - self._frame_id_base + 1, -1, dtype=np.int64)
+      self._frame_id_rows[frame_ids - self._frame_id_base] = np.arange(len(frame_ids))
+
+  def _segment_frame_count(self, seg: int) -> int:
+    fn = self.camera_paths[seg]
+    if fn is None:
+      return 0
+    return len(get_video_index(fn)['index']) - 1
+
+  def _load_offsets(self) -> None:
+    # the per-segment indexes are cached on disk, only the first run of a route reads the videos
+    counts = list(self._pool.map(self._segment_frame_count, range(len(self.camera_paths))))
+    self._seg_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    self._frame_segments = np.repeat(np.arange(len(counts), dtype=np.int32), counts)
+
+  @property
+  def segment_offsets(self) -> np.ndarray:
+    """Global index of the first frame of each segment, with the total frame count appended."""
+    if self._seg_offsets is None:
+      self._load_offsets()
+    assert self._seg_offsets is not None
+    return self._seg_offsets
+
+  def __len__(self) -> int:
+    return int(self.segment_offsets[-1])
+
+  def segment_frame(self, fidx: int) -> tuple[int, int]:
+    if not 0 <= fidx < len(self):
+      raise IndexError(f"frame {fidx} out of range")
+    assert self._frame_segments is not None and self._seg_offsets is not None
+    seg = int(self._frame_segments[fidx])
+    return seg, fidx - int(self._seg_offsets[seg])
+
+  def segment_frame_from_frame_id(self, frame_id: int) -> tuple[int, int]:
+    i = frame_id - self._frame_id_base
+    if not 0 <= i < len(self._frame_id_rows) or self._frame_id_rows[i] < 0:
+      raise KeyError(f"frameId {frame_id} not encoded")
+    _, seg, seg_fidx, _ = self._encode_idx[self._frame_id_rows[i]]
+    return int(seg), int(seg_fidx)
+
+  def segment_frame_from_timestamp(self, timestamp_nanos: int) -> tuple[int, int]:
+    """Returns the last frame whose start of frame is at or before timestamp_nanos."""
+    i = np.searchsorted(self._encode_idx[:, 3], timestamp_nanos, side="right") - 1
+    if i < 0:
+      raise KeyError(f"no frame at {timestamp_nanos}")
+    _, seg, seg_fidx, _ = self._encode_idx[i]
+    return int(seg), int(seg_fidx)
+
+  def get(self, fidx: int) -> np.ndarray:
+    return self.get_segment_frame(*self.segment_frame(fidx))
+
+  def get_frame_id(self, frame_id: int) -> np.ndarray:
+    return self.get_segment_frame(*self.segment_frame_from_frame_id(frame_id))
+
+  def get_timestamp(self, timestamp_nanos: int) -> np.ndarray:
+    return self.get_segment_frame(*self.segment_frame_from_timestamp(timestamp_nanos))
+
+  def get_segment_frame(self, seg: int, fidx: int) -> np.ndarray:
+    fr = self._reader(seg)
+    frame: np.ndarray = fr.get(fidx)
+
+    next_seg = next((s for s in range(seg + 1, len(self.camera_paths)) if self.camera_paths[s] is not None), None)
+    for s in list(self._readers):
+      if s not in (seg, next_seg):
+        self._close_reader(self._readers.pop(s))
+
+    # open the next segment while the last GOP of this one is read
+    if self.prefetch > 0 and next_seg is not None and next_seg not in self._readers and fidx >= fr.iframes[-1]:
+      self._readers[next_seg] = self._pool.submit(self._open_segment, next_seg, True)
+    return frame
+
+  def _open_segment(self, seg: int, warm: bool = False) -> FrameReader:
+    fn = self.camera_paths[seg]
+    if fn is None:
+      raise DataUnreadableError(f"segment {seg} has no video")
+    fr = FrameReader(fn, **self._kwargs)
+    if warm:
+      fr._prefetch_gops(0)
+    return fr
+
+  def _reader(self, seg: int) -> FrameReader:
+    if seg not in self._readers:
+      self._readers[seg] = self._pool.submit(self._open_segment, seg)
+    try:
+      return self._readers[seg].result()
+    except Exception:
+      del self._readers[seg]
+      raise
+
+  @staticmethod
+  def _close_reader(future: Future) -> None:
+    if not future.cancel():
+      future.add_done_callback(lambda f: f.exception() is None and f.result().close())
+
+  def close(self) -> None:
+    for future in self._readers.values():
+      self._close_reader(future)
+    self._readers.clear()
+    self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,103 @@
+import contextlib
+import os
+from collections.abc import Iterable
+from functools import cache
+from typing import BinaryIO
+
+from openpilot.common.file_helpers import atomic_write_in_dir
+from openpilot.system.hardware.hw import Paths
+from openpilot.tools.lib.filereader import file_cache_key
+from openpilot.tools.lib.log_framing import complete_messages_end
+
+DEFAULT_CACHE_SIZE_MB = 10 * 1024
+
+
+class _InvalidLog(Exception):
+  pass
+
+
+class DecompressedLogCache:
+  """Decompressed logs on disk, keyed by source file. The least recently used logs are evicted over max_bytes."""
+  def __init__(self, root: str, max_bytes: int):
+    self.root = root
+    self.max_bytes = max_bytes
+    self.stats = {"hits": 0, "misses": 0, "evictions": 0, "evicted_bytes": 0}
+    os.makedirs(self.root, exist_ok=True)
+
+  def _path(self, fn: str) -> str:
+    return os.path.join(self.root, file_cache_key(fn))
+
+  def get(self, fn: str) -> BinaryIO | None:
+    try:
+      f = open(self._path(fn), "rb")
+    except FileNotFoundError:
+      self.stats["misses"] += 1
+      return None
+
+    # mtime tracks last use for eviction
+    os.utime(f.fileno())
+    self.stats["hits"] += 1
+    return f
+
+  def put(self, fn: str, chunks: Iterable[bytes]) -> BinaryIO | None:
+    """Stores the decompressed chunks of fn. Nothing is stored if the log doesn't end on an event boundary."""
+    path = self._path(fn)
+    tmp_name = None
+    try:
+      with atomic_write_in_dir(path, mode="wb", overwrite=True) as tmp:
+        tmp_name = tmp.name
+        tail = b""
+        for chunk in chunks:
+          tmp.write(chunk)
+          tail = tail + chunk
+          tail = tail[complete_messages_end(tail):]
+        if len(tail):
+          raise _InvalidLog
+    except BaseException as e:
+      # truncated log, or reading or decompressing it failed. evict skips tmp files, so they'd never be removed
+      if tmp_name is not None:
+        with contextlib.suppress(FileNotFoundError):
+          os.remove(tmp_name)
+      if isinstance(e, _InvalidLog):
+        return None
+      raise
+
+    self.evict(keep=path)
+    return open(path, "rb")
+
+  def evict(self, keep: str | None = None) -> None:
+    # skip in-progress atomic writes
+    entries = []
+    for e in os.scandir(self.root):
+      try:
+        if e.is_file() and not e.name.startswith("tmp"):
+          entries.append((e, e.stat()))
+      except FileNotFoundError:
+        continue  # evicted by another process
+
+    total = sum(st.st_size for _, st in entries)
+    for e, st in sorted(entries, key=lambda x: x[1].st_mtime):
+      if total <= self.max_bytes:
+        break
+      if e.path == keep:
+        continue
+      try:
+        os.remove(e.path)
+      except FileNotFoundError:
+        continue
+      total -= st.st_size
+      self.stats["evictions"] += 1
+      self.stats["evicted_bytes"] += st.st_size
+
+
+@cache
+def _get_cache(root: str, max_bytes: int) -> DecompressedLogCache:
+  return DecompressedLogCache(root, max_bytes)
+
+
+def get_log_cache() -> DecompressedLogCache | None:
+  """Returns the decompressed log cache if enabled with LOG_CACHE=1, its size is set with LOG_CACHE_SIZE_MB."""
+  if not int(os.getenv("LOG_CACHE", "0")):
+    return None
+  max_bytes = int(os.getenv("LOG_CACHE_SIZE_MB", str(DEFAULT_CACHE_SIZE_MB))) * 1024 * 1024
+  return _get_cache(os.path.join(Paths.download_cache_root(), "decompressed_logs"), max_bytes)
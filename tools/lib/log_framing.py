@@ -0,0 +1,58 @@
+import struct
+
+# capnp stream framing
+# https://capnproto.org/encoding.html#serialization-over-a-stream
+# (segment count - 1) u32, segment sizes in words u32 * segment count, padding to 8 bytes, segments
+
+WORD_SIZE = 8
+
+
+def message_size(dat, offset: int = 0) -> int:
+  """Returns the size in bytes of the framed message starting at offset, or -1 if the framing header is incomplete."""
+  if len(dat) - offset < 4:
+    return -1
+
+  num_segments: int = struct.unpack_from("<I", dat, offset)[0] + 1
+  header_size = (4 * (num_segments + 1) + 7) & ~7
+  if len(dat) - offset < header_size:
+    return -1
+
+  segment_words: int = sum(struct.unpack_from(f"<{num_segments}I", dat, offset + 4))
+  return header_size + WORD_SIZE * segment_words
+
+
+def complete_messages_end(dat, offset: int = 0) -> int:
+  """Returns the end offset of the last message in dat that is completely contained in it."""
+  end = offset
+  while True:
+    size = message_size(dat, end)
+    if size == -1 or end + size > len(dat):
+      return end
+    end += size
+
+
+def root_data_section(dat, offset: int = 0) -> tuple[int, int]:
+  """Returns the absolute start and size in bytes of the root struct's data section for the framed message
+  starting at offset, or (-1, 0) if it can't be located without a full capnp reader (e.g. far pointers)."""
+  num_segments = struct.unpack_from("<I", dat, offset)[0] + 1
+  segment_start = offset + ((4 * (num_segments + 1) + 7) & ~7)
+
+  # https://capnproto.org/encoding.html#structs
+  # lsb 2 bits pointer type, 30 bits signed word offset, 16 bits data section words, 16 bits pointer count
+  pointer = struct.unpack_from("<Q", dat, segment_start)[0]
+  if pointer & 3 != 0:
+    return -1, 0
+
+  word_offset = (pointer >> 2) & 0x3FFFFFFF
+  if word_offset & 0x20000000:
+    word_offset -= 0x40000000
+  data_start = segment_start + WORD_SIZE * (1 + word_offset)
+  return data_start, WORD_SIZE * ((pointer >> 32) & 0xFFFF)
+
+
+def read_uint(dat, data_start: int, data_size: int, byte_offset: int, fmt: str) -> int:
+  """Reads an unsigned data section field, fields beyond the data section (older schema) read as zero."""
+  if byte_offset + struct.calcsize(fmt) > data_size:
+    return 0
+  value: int = struct.unpack_from(fmt, dat, data_start + byte_offset)[0]
+  return value
@@ -0,0 +1,124 @@
+import contextlib
+import os
+import zipfile
+from array import array
+from collections.abc import Iterable, Iterator
+
+import capnp
+import numpy as np
+
+from cereal import log as capnp_log
+from openpilot.common.file_helpers import atomic_write_in_dir
+from openpilot.system.hardware.hw import Paths
+from openpilot.tools.lib.filereader import file_cache_key
+from openpilot.tools.lib.log_framing import message_size, read_uint, root_data_section
+
+# bump when the index layout or its meaning changes, old sidecars are ignored
+INDEX_VERSION = 1
+
+NO_SERVICE = 0xFFFF
+
+# location of the union discriminant and logMonoTime inside the Event data section
+_EVENT_SCHEMA = capnp_log.Event.schema
+DISCRIMINANT_OFFSET = _EVENT_SCHEMA.node.struct.discriminantOffset * 2
+LOG_MONO_TIME_OFFSET = _EVENT_SCHEMA.fields['logMonoTime'].proto.slot.offset * 8
+SERVICE_DISCRIMINANTS = {f.name: f.discriminantValue for f in _EVENT_SCHEMA.node.struct.fields if f.discriminantValue != NO_SERVICE}
+SERVICE_NAMES = {v: k for k, v in SERVICE_DISCRIMINANTS.items()}
+
+
+def decode_event(dat) -> capnp._DynamicStructReader:
+  return next(iter(capnp_log.Event.read_multiple_bytes(bytes(dat))))
+
+
+def event_header(dat, offset: int, size: int) -> tuple[int, int]:
+  """Returns the union discriminant and logMonoTime of the Event at offset, without building a capnp reader."""
+  data_start, data_size = root_data_section(dat, offset)
+  if data_start == -1:
+    evt = decode_event(dat[offset:offset + size])
+    try:
+      return SERVICE_DISCRIMINANTS[evt.which()], evt.logMonoTime
+    except capnp.KjException:
+      return NO_SERVICE, evt.logMonoTime
+
+  which = read_uint(dat, data_start, data_size, DISCRIMINANT_OFFSET, "<H")
+  log_mono_time = read_uint(dat, data_start, data_size, LOG_MONO_TIME_OFFSET, "<Q")
+  return which, log_mono_time
+
+
+def scan_events(dat, base_offset: int = 0) -> Iterator[tuple[int, int, int, int]]:
+  """Yields (offset, size, discriminant, logMonoTime) for every complete Event in dat."""
+  pos = 0
+  while pos < len(dat):
+    size = message_size(dat, pos)
+    if size == -1 or pos + size > len(dat):
+      return
+    which, log_mono_time = event_header(dat, pos, size)
+    yield base_offset + pos, size, which, log_mono_time
+    pos += size
+
+
+class LogIndex:
+  """Offsets into the decompressed log of every event, with its service and logMonoTime."""
+  def __init__(self, which: np.ndarray, offsets: np.ndarray, sizes: np.ndarray, mono_times: np.ndarray):
+    self.which = which
+    self.offsets = offsets
+    self.sizes = sizes
+    self.mono_times = mono_times
+
+  def __len__(self) -> int:
+    return len(self.offsets)
+
+  def services(self) -> set[str]:
+    return {SERVICE_NAMES[w] for w in np.unique(self.which) if w in SERVICE_NAMES}
+
+  def find(self, services: Iterable[str] | None = None, start_ns: int = 0, end_ns: int | None = None) -> np.ndarray:
+    """Returns the indices of all events of the given services (all if None) with start_ns <= logMonoTime < end_ns, in file order."""
+    mask = self.mono_times >= start_ns
+    if end_ns is not None:
+      mask &= self.mono_times < end_ns
+    if services is not None:
+      mask &= np.isin(self.which, [SERVICE_DISCRIMINANTS[s] for s in services if s in SERVICE_DISCRIMINANTS])
+    return np.flatnonzero(mask)
+
+  def save(self, path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with atomic_write_in_dir(path, mode="wb", overwrite=True) as f:
+      np.savez(f, which=self.which, offsets=self.offsets, sizes=self.sizes, mono_times=self.mono_times)
+
+  @staticmethod
+  def load(path: str) -> 'LogIndex | None':
+    try:
+      with open(path, "rb") as f, np.load(f) as dat:
+        return LogIndex(dat["which"], dat["offsets"], dat["sizes"], dat["mono_times"])
+    except FileNotFoundError:
+      return None
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+      # truncated or corrupt, removed so it's rebuilt
+      with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+      return None
+
+
+class LogIndexBuilder:
+  def __init__(self):
+    self._which = array("H")
+    self._offsets = array("Q")
+    self._sizes = array("I")
+    self._mono_times = array("Q")
+
+  def add(self, offset: int, size: int, which: int, log_mono_time: int) -> None:
+    self._offsets.append(offset)
+    self._sizes.append(size)
+    self._which.append(which)
+    self._mono_times.append(log_mono_time)
+
+  def build(self) -> LogIndex:
+    return LogIndex(np.frombuffer(self._which, dtype=np.uint16), np.frombuffer(self._offsets, dtype=np.uint64),
+                    np.frombuffer(self._sizes, dtype=np.uint32), np.frombuffer(self._mono_times, dtype=np.uint64))
+
+
+def index_path(fn: str) -> str | None:
+  # opt-in like the download cache, sidecars are never evicted
+  if not int(os.environ.get("FILEREADER_CACHE", "0")):
+    return None
+  return os.path.join(Paths.download_cache_root(), f"{file_cache_key(fn)}_index_v{INDEX_VERSION}.npz")
@@ -1,5 +1,13 @@
+import capnp
+import os
+import shutil
+import tempfile
+import urllib.parse
 import numpy as np
 
+# bump when the on-disk layout or the conversion changes, old caches are ignored
+TIME_SERIES_CACHE_VERSION = 1
+
 
 def flatten_type_dict(d, sep="/", prefix=None):
   res = {}
@@ -76,6 +84,108 @@ def msgs_to_time_series(msgs):
   return values
 
 
+def _to_python(value):
+  if isinstance(value, (bool, int, float, str, bytes)):
+    return value
+  elif isinstance(value, capnp.lib.capnp._DynamicListReader):
+    return [_to_python(v) for v in value]
+  elif hasattr(value, 'to_dict'):
+    return value.to_dict(verbose=True)
+  # enums
+  return str(value)
+
+
+def msgs_to_records(msgs, fields: dict[str, list[str]]) -> dict[str, np.ndarray]:
+  """
+    Convert an iterable of canonical capnp messages into one record array per service in fields,
+    with a time column "t" in seconds and one column per requested (possibly nested, e.g. "actuators.accel") field.
+  """
+  getters = {service: [name.split(".") for name in names] for service, names in fields.items()}
+  values: dict[str, list] = {service: [] for service in fields}
+  for msg in msgs:
+    typ = msg.which()
+    if typ not in getters:
+      continue
+
+    service_msg = getattr(msg, typ)
+    row = [msg.logMonoTime / 1.0e9]
+    for path in getters[typ]:
+      value = service_msg
+      for key in path:
+        value = getattr(value, key)
+      row.append(_to_python(value))
+    values[typ].append(row)
+
+  records: dict[str, np.ndarray] = {}
+  for service, rows in values.items():
+    names = ["t", *fields[service]]
+    columns = [potentially_ragged_array([row[i] for row in rows]) for i in range(len(names))]
+    order = np.argsort(columns[0], kind="stable")
+
+    # fixed size lists become sub-array fields
+    records[service] = np.recarray(len(rows), dtype=[(name, c.dtype, c.shape[1:]) for name, c in zip(names, columns, strict=True)])
+    for name, c in zip(names, columns, strict=True):
+      records[service][name] = c[order]
+  return records
+
+
+def _column_file_name(name: str) -> str:
+  # flattened field names contain "/"
+  return urllib.parse.quote(name, safe="") + ".npy"
+
+
+def save_time_series(values: dict[str, dict[str, np.ndarray]], path: str) -> None:
+  """
+    Writes a time series dictionary as one typed .npy column per service and field.
+    The directory is populated next to path and moved in place once complete.
+  """
+  parent = os.path.dirname(os.path.abspath(path))
+  os.makedirs(parent, exist_ok=True)
+  tmp_path = tempfile.mkdtemp(dir=parent)
+  try:
+    for service, group in values.items():
+      os.makedirs(os.path.join(tmp_path, service))
+      for name, column in group.items():
+        column = np.asarray(column)
+        np.save(os.path.join(tmp_path, service, _column_file_name(name)), column, allow_pickle=column.dtype == object)
+    try:
+      os.replace(tmp_path, path)
+    except OSError:
+      # populated concurrently by another reader
+      if not os.path.isdir(path):
+        raise
+  finally:
+    shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_time_series(path: str) -> dict[str, dict[str, np.ndarray]]:
+  """
+    Reads back a time series dictionary written by save_time_series. Typed columns are memory-mapped copy-on-write,
+    so they can be modified without changing the files. Ragged columns are pickled object arrays, only load trusted paths.
+  """
+  values: dict[str, dict[str, np.ndarray]] = {}
+  for service in os.listdir(path):
+    group = values[service] = {}
+    for fn in os.listdir(os.path.join(path, service)):
+      name = urllib.parse.unquote(fn.removesuffix(".npy"))
+      try:
+        group[name] = np.load(os.path.join(path, service, fn), mmap_mode='c')
+      except ValueError:
+        group[name] = np.load(os.path.join(path, service, fn), allow_pickle=True)
+  return values
+
+
+def cached_msgs_to_time_series(msgs, cache_dir: str):
+  """
+    Same as msgs_to_time_series, but the result is written to (or read from) cache_dir.
+    cache_dir must uniquely identify the messages.
+  """
+  path = os.path.join(cache_dir, f"v{TIME_SERIES_CACHE_VERSION}")
+  if not os.path.isdir(path):
+    save_time_series(msgs_to_time_series(msgs), path)
+  return load_time_series(path)
+
+
 if __name__ == "__main__":
   import sys
   from openpilot.tools.lib.logreader import LogReader
@@ -3,7 +3,10 @@ import bz2
 from functools import partial
 import multiprocessing
 import capnp
+import contextlib
 import enum
+import numpy as np
+import io
 import os
 import pathlib
 import sys
@@ -12,23 +15,36 @@ import urllib.parse
 import warnings
 import zstandard as zstd
 
-from collections.abc import Callable, Iterable, Iterator
+from collections import deque
+from collections.abc import Callable, Generator, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import cast
 from urllib.parse import parse_qs, urlparse
 
 from cereal import log as capnp_log
 from openpilot.common.swaglog import cloudlog
+from openpilot.system.hardware.hw import Paths
 from openpilot.tools.lib.comma_car_segments import get_url as get_comma_segments_url
 from openpilot.tools.lib.openpilotci import get_url
-from openpilot.tools.lib.filereader import DATA_ENDPOINT, FileReader, file_exists, internal_source_available
+from openpilot.tools.lib.filereader import DATA_ENDPOINT, FileReader, file_cache_key, file_exists, internal_source_available, read_buffer
 from openpilot.tools.lib.route import QCAMERA_FILENAMES, CAMERA_FILENAMES, DCAMERA_FILENAMES, \
   ECAMERA_FILENAMES, BOOTLOG_FILENAMES, Route, SegmentRange
-from openpilot.tools.lib.log_time_series import msgs_to_time_series
+from openpilot.tools.lib.log_cache import get_log_cache
+from openpilot.tools.lib.log_framing import complete_messages_end
+from openpilot.tools.lib.log_index import SERVICE_DISCRIMINANTS, LogIndex, LogIndexBuilder, decode_event, index_path, scan_events
+from openpilot.tools.lib.log_time_series import cached_msgs_to_time_series, msgs_to_records, msgs_to_time_series
+from openpilot.tools.lib.url_file import hash_256
 
 LogMessage = type[capnp._DynamicStructReader]
 LogIterable = Iterable[LogMessage]
 RawLogIterable = Iterable[bytes]
 
+# size of compressed reads and decompressed windows when streaming
+STREAM_READ_SIZE = 1024 * 1024
+
+# max concurrent file_exists checks while resolving sources
+SOURCE_PROBE_WORKERS = 16
+
 
 def save_log(dest, log_msgs, compress=True):
   dat = b"".join(msg.as_builder().to_bytes() for msg in log_msgs)
@@ -50,24 +66,78 @@ def decompress_stream(data: bytes):
 
   return decompressed_data
 
+def decompress_chunks(f, ext: str | None = None, chunk_size: int = STREAM_READ_SIZE) -> Iterator[bytes]:
+  """Decompresses a zstd, bz2 or uncompressed file object in bounded-size chunks."""
+  head = f.read(4)
+  f.seek(0)
+
+  if ext == ".bz2" or head.startswith(b'BZh9'):
+    dctx = bz2.BZ2Decompressor()
+    dat = b""
+    while True:
+      # bz2 files may be made of multiple concatenated streams
+      if dctx.eof:
+        dat, dctx = dctx.unused_data, bz2.BZ2Decompressor()
+      if dctx.needs_input and not dat:
+        dat = f.read(chunk_size)
+        if not dat:
+          break
+      chunk = dctx.decompress(dat, max_length=chunk_size)
+      dat = b""
+      if chunk:
+        yield chunk
+  elif ext == ".zst" or head.startswith(b'\x28\xB5\x2F\xFD'):
+    with zstd.ZstdDecompressor().stream_reader(f, read_size=chunk_size, read_across_frames=True) as reader:
+      while chunk := reader.read(chunk_size):
+        yield chunk
+  else:
+    while chunk := f.read(chunk_size):
+      yield chunk
+
+
+def framed_windows(chunks: Iterable[bytes]) -> Iterator[bytes]:
+  """Regroups a stream of byte chunks into windows that only contain complete capnp messages."""
+  buf = bytearray()
+  for chunk in chunks:
+    buf += chunk
+    end = complete_messages_end(buf)
+    if end > 0:
+      yield bytes(buf[:end])
+      del buf[:end]
+
+  # truncated trailing event, let capnp report it as corrupted
+  if len(buf):
+    yield bytes(buf)
+
+
 class _LogFileReader:
-  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None):
+  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None, stream=False):
     self.data_version = None
     self._only_union_types = only_union_types
+    self._fn = fn
+    self._dat = dat
+    self._stream = stream
+    assert not (stream and sort_by_time), "sort_by_time needs the whole file and can't be used when streaming"
 
-    ext = None
+    self._ext = None
     if not dat:
-      _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
-      if ext not in ('', '.bz2', '.zst'):
+      _, self._ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+      if self._ext not in ('', '.bz2', '.zst'):
         # old rlogs weren't compressed
-        raise ValueError(f"unknown extension {ext}")
+        raise ValueError(f"unknown extension {self._ext}")
 
-      with FileReader(fn) as f:
-        dat = f.read()
+    # events are decoded lazily on every iteration
+    if stream:
+      return
+
+    ext = self._ext
+    if not dat:
+      with self._open() as (f, ext):
+        dat = read_buffer(f)
 
-    if ext == ".bz2" or dat.startswith(b'BZh9'):
+    if ext == ".bz2" or dat[:4] == b'BZh9':
       dat = bz2.decompress(dat)
-    elif ext == ".zst" or dat.startswith(b'\x28\xB5\x2F\xFD'):
+    elif ext == ".zst" or dat[:4] == b'\x28\xB5\x2F\xFD':
       # https://github.com/facebook/zstd/blob/dev/doc/zstd_compression_format.md#zstandard-frames
       dat = decompress_stream(dat)
 
@@ -83,8 +153,121 @@ class _LogFileReader:
     if sort_by_time:
       self._ents.sort(key=lambda x: x.logMonoTime)
 
+  @contextlib.contextmanager
+  def _open(self):
+    # yields the file object and its extension, already decompressed logs are read from the log cache
+    log_cache = get_log_cache()
+    if self._dat:
+      yield io.BytesIO(self._dat), self._ext
+    elif log_cache is not None and self._ext in ('.bz2', '.zst'):
+      f = log_cache.get(self._fn)
+      if f is None:
+        with FileReader(self._fn) as compressed:
+          f = log_cache.put(self._fn, decompress_chunks(compressed, self._ext))
+      if f is None:
+        # not cacheable, e.g. truncated
+        with FileReader(self._fn) as f:
+          yield f, self._ext
+      else:
+        with f:
+          yield f, ''
+    else:
+      with FileReader(self._fn) as f:
+        yield f, self._ext
+
+  def _windows(self) -> Generator[tuple[int, bytes], None, None]:
+    # yields (offset in the decompressed log, window of complete events)
+    with self._open() as (f, ext):
+      offset = 0
+      for window in framed_windows(decompress_chunks(f, ext)):
+        yield offset, window
+        offset += len(window)
+
+  def _stream_events(self) -> Iterator[capnp._DynamicStructReader]:
+    for _, window in self._windows():
+      try:
+        yield from capnp_log.Event.read_multiple_bytes(window)
+      except capnp.KjException:
+        warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+        return
+
+  def _index_path(self) -> str | None:
+    # no sidecar for in-memory logs or without FILEREADER_CACHE
+    return None if self._dat else index_path(self._fn)
+
+  def load_index(self) -> LogIndex | None:
+    path = self._index_path()
+    return None if path is None else LogIndex.load(path)
+
+  def get_index(self) -> LogIndex:
+    """Loads the index sidecar of the file, or builds it with a single pass over the file without decoding events."""
+    path = self._index_path()
+    index = None if path is None else LogIndex.load(path)
+    if index is None:
+      builder = LogIndexBuilder()
+      for base, window in self._windows():
+        for event in scan_events(window, base):
+          builder.add(*event)
+      index = builder.build()
+      if path is not None:
+        index.save(path)
+    return index
+
+  def first_mono_time(self) -> int | None:
+    """Returns the logMonoTime of the first event, only decompressing the start of the file if there's no index sidecar yet."""
+    index = self.load_index()
+    if index is not None:
+      return int(index.mono_times[0]) if len(index) else None
+
+    windows = self._windows()
+    try:
+      for base, window in windows:
+        for _, _, _, log_mono_time in scan_events(window, base):
+          return log_mono_time
+    finally:
+      windows.close()
+    return None
+
+  def read_indexed(self, services: set[str] | None = None, start_ns: int = 0, end_ns: int | None = None) -> Iterator[capnp._DynamicStructReader]:
+    """Yields the events of the given services (all if None) with start_ns <= logMonoTime < end_ns in file order,
+    only decoding those events. Uses the index sidecar of the file, and builds it while reading if it doesn't exist yet."""
+    path = self._index_path()
+    index = None if path is None else LogIndex.load(path)
+    if index is None:
+      yield from self._read_and_index(services, start_ns, end_ns, path)
+      return
+
+    idxs = index.find(services, start_ns, end_ns)
+    if len(idxs) == 0:
+      return  # skip the file entirely
+
+    offsets, sizes = index.offsets[idxs], index.sizes[idxs]
+    i = 0
+    for base, window in self._windows():
+      while i < len(offsets) and offsets[i] < base + len(window):
+        start = int(offsets[i]) - base
+        yield decode_event(window[start:start + int(sizes[i])])
+        i += 1
+      # nothing left to read after the last matching event
+      if i == len(offsets):
+        return
+
+  def _read_and_index(self, services: set[str] | None, start_ns: int, end_ns: int | None,
+                      path: str | None) -> Iterator[capnp._DynamicStructReader]:
+    wanted = None if services is None else {SERVICE_DISCRIMINANTS[s] for s in services if s in SERVICE_DISCRIMINANTS}
+    builder = LogIndexBuilder()
+    for base, window in self._windows():
+      for offset, size, which, log_mono_time in scan_events(window, base):
+        builder.add(offset, size, which, log_mono_time)
+        if (wanted is None or which in wanted) and start_ns <= log_mono_time and (end_ns is None or log_mono_time < end_ns):
+          yield decode_event(window[offset - base:offset - base + size])
+
+    # only reached when the whole file was read
+    if path is not None:
+      builder.build().save(path)
+
   def __iter__(self) -> Iterator[capnp._DynamicStructReader]:
-    for ent in self._ents:
+    for ent in (self._stream_events() if self._stream else self._ents):
       if self._only_union_types:
         try:
           ent.which()
@@ -157,20 +340,17 @@ def direct_source(file_or_url: str) -> list[str]:
 
 def eval_source(files: list[list[str] | str]) -> list[LogPath]:
   # Returns valid file URLs given a list of possible file URLs for each segment (e.g. rlog.bz2, rlog.zst)
-  valid_files: list[LogPath] = []
-
-  for urls in files:
+  def first_valid(urls: list[str] | str) -> LogPath:
     if isinstance(urls, str):
       urls = [urls]
 
     for url in urls:
       if file_exists(url):
-        valid_files.append(url)
-        break
-    else:
-      valid_files.append(None)
+        return url
+    return None
 
-  return valid_files
+  with ThreadPoolExecutor(max_workers=SOURCE_PROBE_WORKERS) as pool:
+    return list(pool.map(first_valid, files))
 
 
 def auto_source(identifier: str, sources: list[Source], default_mode: ReadMode) -> list[str]:
@@ -269,7 +449,8 @@ class LogReader:
     return identifiers
 
   def __init__(self, identifier: str | list[str], default_mode: ReadMode = ReadMode.RLOG,
-               sources: list[Source] = None, sort_by_time=False, only_union_types=False):
+               sources: list[Source] = None, sort_by_time=False, only_union_types=False, stream=False, use_index=True,
+               prefetch: int = 0, start_time: float | None = None, end_time: float | None = None):
     if sources is None:
       sources = [internal_source, openpilotci_source, comma_api_source, comma_car_segments_source]
 
@@ -281,18 +462,60 @@ class LogReader:
 
     self.sort_by_time = sort_by_time
     self.only_union_types = only_union_types
+    # decode events while iterating instead of loading whole segments into memory
+    self.stream = stream
+    # filter/first only decode matching events, using a per-file index sidecar with FILEREADER_CACHE=1
+    self.use_index = use_index
+    # number of segments downloaded and decoded ahead of the one being iterated
+    self.prefetch = prefetch
+    # only read events in this window, in seconds since the first event of the first log
+    self.start_time = start_time
+    self.end_time = end_time
 
     self.__lrs: dict[int, _LogFileReader] = {}
+    self.__indexes: dict[int, LogIndex] = {}
+    self.__first_mono_times: dict[int, int | None] = {}
     self.reset()
 
   def _get_lr(self, i):
     if i not in self.__lrs:
-      self.__lrs[i] = _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types)
+      self.__lrs[i] = _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types,
+                                     stream=self.stream)
     return self.__lrs[i]
 
+  def _prefetch_lr(self, i):
+    if not self.stream:
+      return self._get_lr(i)
+
+    # only download ahead, streamed segments are still decompressed while iterating
+    fn = self.logreader_identifiers[i]
+    with FileReader(fn) as f:
+      dat = f.read()
+    return _LogFileReader(fn, only_union_types=self.only_union_types, dat=dat, stream=True)
+
   def __iter__(self):
-    for i in range(len(self.logreader_identifiers)):
-      yield from self._get_lr(i)
+    if self.start_time is not None or self.end_time is not None:
+      yield from self._read_window(None)
+      return
+
+    if self.prefetch <= 0:
+      for i in range(len(self.logreader_identifiers)):
+        yield from self._get_lr(i)
+      return
+
+    # segments are prepared in the background, but still yielded in route order
+    pool = ThreadPoolExecutor(max_workers=self.prefetch)
+    try:
+      futures: deque[Future] = deque()
+      num_segs = len(self.logreader_identifiers)
+      next_seg = 0
+      for _ in range(num_segs):
+        while next_seg < num_segs and len(futures) <= self.prefetch:
+          futures.append(pool.submit(self._prefetch_lr, next_seg))
+          next_seg += 1
+        yield from futures.popleft().result()
+    finally:
+      pool.shutdown(wait=False, cancel_futures=True)
 
   def _run_on_segment(self, func, i):
     return func(self._get_lr(i))
@@ -314,15 +537,101 @@ class LogReader:
   def from_bytes(dat):
     return _LogFileReader("", dat=dat)
 
+  def _first_mono_time(self, i) -> int | None:
+    if i in self.__indexes:
+      return int(self.__indexes[i].mono_times[0]) if len(self.__indexes[i]) else None
+    if i not in self.__first_mono_times:
+      self.__first_mono_times[i] = _LogFileReader(self.logreader_identifiers[i], stream=True).first_mono_time()
+    return self.__first_mono_times[i]
+
+  def _time_window(self) -> tuple[int, int | None]:
+    # start_time and end_time are relative to the first event of the first log
+    route_start_ns = 0
+    if len(self.logreader_identifiers) and (first_mono_time := self._first_mono_time(0)) is not None:
+      route_start_ns = first_mono_time
+    start_ns = 0 if self.start_time is None else route_start_ns + int(self.start_time * 1e9)
+    end_ns = None if self.end_time is None else route_start_ns + int(self.end_time * 1e9)
+    return start_ns, end_ns
+
+  def _get_index(self, i) -> LogIndex | None:
+    # only loads existing index sidecars, they are built while reading the segments in the window
+    if i not in self.__indexes:
+      index = _LogFileReader(self.logreader_identifiers[i], stream=True).load_index()
+      if index is None:
+        return None
+      self.__indexes[i] = index
+    return self.__indexes[i]
+
+  def _read_window(self, services: set[str] | None) -> Iterator[capnp._DynamicStructReader]:
+    start_ns, end_ns = self._time_window()
+    if services is None and self.only_union_types:
+      services = set(SERVICE_DISCRIMINANTS)
+
+    for i, fn in enumerate(self.logreader_identifiers):
+      index = self._get_index(i)
+      if index is not None:
+        # the index tells us which segments overlap the window without reading them
+        if len(index) == 0 or index.mono_times.max() < start_ns:
+          continue
+        if end_ns is not None and index.mono_times.min() >= end_ns:
+          break
+      else:
+        # segments are in route order, nothing after the window needs to be read
+        if end_ns is not None:
+          first_mono_time = self._first_mono_time(i)
+          if first_mono_time is not None and first_mono_time >= end_ns:
+            break
+        # and nothing before it, the start of the next segment only needs its first events
+        if self.start_time is not None and i + 1 < len(self.logreader_identifiers):
+          next_mono_time = self._first_mono_time(i + 1)
+          if next_mono_time is not None and next_mono_time <= start_ns:
+            continue
+
+      msgs = _LogFileReader(fn, stream=True).read_indexed(services, start_ns, end_ns)
+      if self.sort_by_time:
+        msgs = iter(sorted(msgs, key=lambda x: x.logMonoTime))
+      yield from msgs
+
+  def _filter_services(self, services: set[str]) -> Iterator[capnp._DynamicStructReader]:
+    if self.start_time is not None or self.end_time is not None:
+      yield from self._read_window(services)
+      return
+
+    if not self.use_index:
+      yield from (m for m in self if m.which() in services)
+      return
+
+    for i, fn in enumerate(self.logreader_identifiers):
+      # without sidecars the segment is decoded once and kept for the next call, like when iterating
+      if not self.stream and (i in self.__lrs or index_path(fn) is None):
+        yield from (m for m in self._get_lr(i) if m.which() in services)
+        continue
+
+      msgs = _LogFileReader(fn, stream=True).read_indexed(services)
+      if self.sort_by_time:
+        msgs = iter(sorted(msgs, key=lambda x: x.logMonoTime))
+      yield from msgs
+
   def filter(self, msg_type: str):
-    return (getattr(m, m.which()) for m in filter(lambda m: m.which() == msg_type, self))
+    return (getattr(m, m.which()) for m in self._filter_services({msg_type}))
 
   def first(self, msg_type: str):
     return next(self.filter(msg_type), None)
 
+  def select(self, fields: dict[str, list[str]]) -> dict[str, np.ndarray]:
+    """
+      Returns a record array per service with the time in seconds ("t") and the requested fields,
+      e.g. select({"carState": ["vEgo", "steeringAngleDeg"]}). Other services are skipped without being decoded.
+    """
+    return msgs_to_records(self._filter_services(set(fields)), fields)
+
   @property
   def time_series(self):
-    return msgs_to_time_series(self)
+    # opt-in like the download cache, columns are cached on disk per set of files and repeat analyses only load them back
+    if not int(os.environ.get("FILEREADER_CACHE", "0")):
+      return msgs_to_time_series(self)
+    key = hash_256("|".join(file_cache_key(fn) for fn in self.logreader_identifiers) + f"|{self.only_union_types}")
+    return cached_msgs_to_time_series(self, os.path.join(Paths.download_cache_root(), "time_series", key))
 
 if __name__ == "__main__":
   import codecs
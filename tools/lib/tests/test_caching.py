@@ -6,6 +6,7 @@ import pytest
 
 from openpilot.selfdrive.test.helpers import http_server_context
 from openpilot.system.hardware.hw import Paths
+from openpilot.tools.lib import url_file
 from openpilot.tools.lib.url_file import URLFile
 
 
@@ -28,6 +29,27 @@ class CachingTestRequestHandler(http.server.BaseHTTPRequestHandler):
     self.end_headers()
 
 
+class RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+  DATA = bytes(range(256)) * 1000
+
+  def do_GET(self):
+    if "Range" not in self.headers:
+      self.send_response(200)
+      self.end_headers()
+      self.wfile.write(self.DATA)
+      return
+
+    start, end = (int(x) for x in self.headers["Range"].removeprefix("bytes=").split("-"))
+    self.send_response(206)
+    self.end_headers()
+    self.wfile.write(self.DATA[start:end + 1])
+
+  def do_HEAD(self):
+    self.send_response(200)
+    self.send_header("Content-Length", str(len(self.DATA)))
+    self.end_headers()
+
+
 @pytest.fixture
 def host():
   with http_server_context(handler=CachingTestRequestHandler) as (host, port):
@@ -128,3 +150,16 @@ class TestFileDownload:
     CachingTestRequestHandler.FILE_EXISTS = True
     length = URLFile(file_url).get_length()
     assert length == 4
+
+  def test_parallel_chunk_download(self, mocker):
+    mocker.patch.object(url_file, "CHUNK_SIZE", 10000)
+    data = RangeRequestHandler.DATA
+    with http_server_context(handler=RangeRequestHandler) as (host, port):
+      url = f"http://{host}:{port}/test.bin"
+      for start, length in [(0, None), (12345, 100), (5000, 50000), (len(data) - 10, None)]:
+        f = URLFile(url, cache=True)
+        f.seek(start)
+        assert f.read(ll=length) == data[start:start + length if length is not None else None]
+
+        f.seek(start)
+        assert f.read_view(ll=length) == data[start:start + length if length is not None else None]
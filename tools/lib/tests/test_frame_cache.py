@@ -0,0 +1,113 @@
+import contextlib
+import errno
+import multiprocessing
+import os
+import tempfile
+from types import SimpleNamespace
+import numpy as np
+
+from openpilot.common.file_helpers import atomic_write_in_dir
+from openpilot.tools.lib import frame_cache
+from openpilot.tools.lib.frame_cache import SharedFrameCache, get_frame_cache
+
+SHAPE = (4, 8, 3)
+
+
+def frame(fidx: int) -> np.ndarray:
+  return np.full(SHAPE, fidx, dtype=np.uint8)
+
+
+class FullFile:
+  # writes a partial frame, then runs out of space
+  def __init__(self, f):
+    self.f = f
+    self.name = f.name
+
+  def write(self, dat):
+    self.f.write(bytes(dat)[:1])
+    raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+
+@contextlib.contextmanager
+def full_disk(path, **kwargs):
+  with atomic_write_in_dir(path, **kwargs) as f:
+    yield FullFile(f)
+
+
+def put_frames(prefix: str, fidxs: range) -> None:
+  os.environ["OPENPILOT_PREFIX"] = prefix
+  cache = get_frame_cache()
+  assert cache is not None
+  for fidx in fidxs:
+    cache.put("video", fidx, frame(fidx))
+
+
+def get_frames(prefix: str, fidxs: range, q) -> None:
+  os.environ["OPENPILOT_PREFIX"] = prefix
+  cache = get_frame_cache()
+  assert cache is not None
+  hits = []
+  for fidx in fidxs:
+    cached = cache.get("video", fidx, SHAPE)
+    hits.append(cached is not None and bool((cached == frame(fidx)).all()))
+  q.put(hits)
+
+
+class TestFrameCache:
+  def test_shared_across_prefixes(self, monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      monkeypatch.setenv("FRAME_CACHE", "1")
+      monkeypatch.setattr(frame_cache, "SHM_ROOT", tmpdir)
+      frame_cache._get_cache.cache_clear()
+
+      # forked, so the workers see the patched root
+      ctx = multiprocessing.get_context("fork")
+      p = ctx.Process(target=put_frames, args=("prefix_a", range(10)))
+      p.start()
+      p.join()
+      assert p.exitcode == 0
+
+      q = ctx.Queue()
+      p = ctx.Process(target=get_frames, args=("prefix_b", range(12), q))
+      p.start()
+      hits = q.get(timeout=10)
+      p.join()
+      assert hits == [True] * 10 + [False] * 2
+
+      # a single directory for all prefixes
+      assert os.listdir(tmpdir) == ["openpilot_frame_cache"]
+
+  def test_evicts_over_budget(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      nbytes = frame(0).nbytes
+      cache = SharedFrameCache(tmpdir, max_bytes=10 * nbytes)
+      for fidx in range(100):
+        cache.put("video", fidx, frame(fidx))
+        os.utime(os.path.join(tmpdir, f"video_{fidx}"), (fidx, fidx))
+      cache.evict()
+
+      assert sum(os.path.getsize(os.path.join(tmpdir, fn)) for fn in os.listdir(tmpdir)) <= 10 * nbytes
+      # least recently used frames go first
+      assert cache.get("video", 99, SHAPE) is not None
+      assert cache.get("video", 0, SHAPE) is None
+
+  def test_out_of_space(self, monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      cache = SharedFrameCache(tmpdir, max_bytes=10 * frame(0).nbytes)
+      monkeypatch.setattr(frame_cache, "atomic_write_in_dir", full_disk)
+      cache.put("video", 0, frame(0))
+
+      # the partial frame is removed and the frame isn't cached
+      assert os.listdir(tmpdir) == []
+      assert cache.get("video", 0, SHAPE) is None
+      assert cache.stats["write_errors"] == 1
+
+  def test_budget_capped_at_free_space(self, monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      cache = SharedFrameCache(tmpdir, max_bytes=100 * frame(0).nbytes)
+      cache.put("video", 0, frame(0))
+
+      monkeypatch.setattr(frame_cache.os, "statvfs", lambda _: SimpleNamespace(f_bavail=10, f_frsize=frame(0).nbytes))
+      # frames already in the cache can be evicted to make space
+      assert SharedFrameCache(tmpdir, max_bytes=100 * frame(0).nbytes).max_bytes == 11 * frame(0).nbytes
+      assert SharedFrameCache(tmpdir, max_bytes=5 * frame(0).nbytes).max_bytes == 5 * frame(0).nbytes
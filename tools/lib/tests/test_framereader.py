@@ -0,0 +1,185 @@
+import os
+import subprocess
+from types import SimpleNamespace
+import pytest
+import numpy as np
+
+from openpilot.tools.lib import frame_cache, framereader
+from openpilot.tools.lib.framereader import FfmpegDecoder, FrameIterator, FrameReader, RouteFrameReader, decompress_video_data, get_video_index, \
+  load_video_index, video_index_path
+
+NUM_FRAMES = 30
+GOP_SIZE = 10
+W, H = 64, 48
+
+
+def encode_video(fn: str, frames: int = NUM_FRAMES, pattern: str = "testsrc") -> None:
+  subprocess.check_call(["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", f"{pattern}=size={W}x{H}:rate=20", "-frames:v", str(frames),
+                         "-c:v", "libx265", "-x265-params", f"log-level=error:keyint={GOP_SIZE}:min-keyint={GOP_SIZE}:scenecut=0:bframes=0",
+                         "-f", "hevc", fn])
+
+
+def decode_all(fn: str, **kwargs) -> np.ndarray:
+  # plain decode of the whole file in one ffmpeg call
+  with open(fn, "rb") as f:
+    return decompress_video_data(f.read(), W, H, **kwargs)
+
+
+@pytest.fixture
+def video(tmp_path, monkeypatch):
+  monkeypatch.setenv("COMMA_CACHE", str(tmp_path / "cache"))
+  fn = str(tmp_path / "fcamera.hevc")
+  encode_video(fn)
+  return fn
+
+
+class TestFrameReader:
+  def test_video_index_cache(self, video, mocker, monkeypatch):
+    index_spy = mocker.spy(framereader, "hevc_index")
+    # opt-in, nothing is written without FILEREADER_CACHE
+    monkeypatch.delenv("FILEREADER_CACHE", raising=False)
+    get_video_index(video)
+    assert video_index_path(video) is None
+    assert index_spy.call_count == 1
+
+    monkeypatch.setenv("FILEREADER_CACHE", "1")
+    index_spy.reset_mock()
+    index_data = get_video_index(video)
+    assert os.path.exists(video_index_path(video))
+    assert len(index_data["index"]) == NUM_FRAMES + 1
+    assert index_data["index"][::GOP_SIZE, 0].tolist()[:-1] == [framereader.HEVC_SLICE_I] * (NUM_FRAMES // GOP_SIZE)
+
+    cached = get_video_index(video)
+    assert index_spy.call_count == 1
+    np.testing.assert_array_equal(cached["index"], index_data["index"])
+    assert cached["global_prefix"] == index_data["global_prefix"]
+    assert cached["probe"] == index_data["probe"]
+
+    get_video_index(video, cache=False)
+    assert index_spy.call_count == 2
+
+    # a truncated index is removed and rebuilt
+    with open(video_index_path(video), "r+b") as f:
+      f.truncate(100)
+    np.testing.assert_array_equal(get_video_index(video)["index"], index_data["index"])
+    assert index_spy.call_count == 3
+    assert load_video_index(video_index_path(video)) is not None
+
+  def test_iterator(self, video, mocker):
+    expected = decode_all(video)
+    assert len(expected) == NUM_FRAMES
+
+    get_video_index(video)
+    popen_spy = mocker.spy(framereader.subprocess, "Popen")
+    frames = list(FrameIterator(video))
+    np.testing.assert_array_equal(np.stack(frames), expected)
+    assert popen_spy.call_count == 1
+
+    # starting inside a GOP and skipping frames, one decoder for the whole range
+    frames = list(FfmpegDecoder(video).get_iterator(start_fidx=13, end_fidx=27, frame_skip=3))
+    assert [fidx for fidx, _ in frames] == list(range(13, 27, 3))
+    for fidx, frame in frames:
+      np.testing.assert_array_equal(frame, expected[fidx])
+
+  def test_get(self, video):
+    expected = decode_all(video)
+    fr = FrameReader(video)
+    # forwards, backwards and across GOPs
+    for fidx in [0, 1, 9, 10, 29, 5, 21, 20, 3]:
+      np.testing.assert_array_equal(fr.get(fidx), expected[fidx])
+    fr.close()
+
+  @pytest.mark.parametrize("prefetch", [1, 3])
+  def test_prefetch(self, video, prefetch):
+    expected = decode_all(video)
+    fr = FrameReader(video, prefetch=prefetch, cache_size=5)
+    for fidx in [*range(NUM_FRAMES), 25, 2, 14, 29, 0]:
+      np.testing.assert_array_equal(fr.get(fidx), expected[fidx])
+
+    # the GOPs after the requested one are decoding or decoded already
+    fr.get(0)
+    assert sorted(fr._gops) == [0, 10, 20][:prefetch + 1]
+    fr.close()
+
+  def test_frame_cache(self, video, tmp_path, monkeypatch, mocker):
+    monkeypatch.setenv("FRAME_CACHE", "1")
+    monkeypatch.setattr(frame_cache, "SHM_ROOT", str(tmp_path))
+    frame_cache._get_cache.cache_clear()
+    expected = decode_all(video)
+
+    fr = FrameReader(video)
+    for fidx in range(NUM_FRAMES):
+      np.testing.assert_array_equal(fr.get(fidx), expected[fidx])
+    fr.close()
+
+    # a second reader only reads the shared cache
+    decode_spy = mocker.spy(FfmpegDecoder, "get_iterator")
+    fr = FrameReader(video, cache_size=1)
+    for fidx in reversed(range(NUM_FRAMES)):
+      np.testing.assert_array_equal(fr.get(fidx), expected[fidx])
+    assert decode_spy.call_count == 0
+    fr.close()
+
+  def test_cache_bytes(self, video):
+    expected = decode_all(video)
+    fr = FrameReader(video, cache_bytes=3 * expected[0].nbytes)
+    for fidx in range(NUM_FRAMES):
+      np.testing.assert_array_equal(fr.get(fidx), expected[fidx])
+      assert fr._cache.nbytes <= 3 * expected[0].nbytes
+    fr.close()
+
+  @pytest.mark.parametrize("pix_fmt", ["rgb24", "nv12", "gray"])
+  def test_crop_scale(self, video, pix_fmt):
+    crop, scale = (16, 8, 32, 24), (16, 12)
+    expected = decode_all(video, pix_fmt=pix_fmt, crop=crop, scale=scale)
+    fr = FrameReader(video, pix_fmt=pix_fmt, crop=crop, scale=scale, prefetch=1)
+    assert (fr.w, fr.h) == scale
+    for fidx in [0, 11, 29]:
+      np.testing.assert_array_equal(fr.get(fidx), expected[fidx])
+    fr.close()
+
+    if pix_fmt == "rgb24":
+      # crop is (x, y, w, h) in the source frame
+      full = decode_all(video)[0]
+      cropped = decode_all(video, crop=crop)[0]
+      np.testing.assert_array_equal(cropped, full[8:32, 16:48])
+
+
+class TestRouteFrameReader:
+  @pytest.mark.parametrize("prefetch", [0, 1])
+  def test_route(self, tmp_path, monkeypatch, prefetch):
+    monkeypatch.setenv("COMMA_CACHE", str(tmp_path / "cache"))
+    # the second segment has no video
+    paths = [str(tmp_path / "0_fcamera.hevc"), None, str(tmp_path / "2_fcamera.hevc")]
+    encode_video(paths[0], 20, "testsrc")
+    encode_video(paths[2], 30, "smptebars")
+    expected = np.concatenate([decode_all(paths[0]), decode_all(paths[2])])
+
+    # frameIds continue across segments, frame 5 of the last segment was dropped
+    encode_idxs = [SimpleNamespace(type='fullHEVC', frameId=i, segmentNum=0, segmentId=i, timestampSof=i * 50) for i in range(20)]
+    encode_idxs += [SimpleNamespace(type='fullHEVC', frameId=40 + i, segmentNum=2, segmentId=i, timestampSof=(40 + i) * 50) for i in range(30) if i != 5]
+    encode_idxs.append(SimpleNamespace(type='bigBoxLossless', frameId=0, segmentNum=0, segmentId=0, timestampSof=0))
+
+    rfr = RouteFrameReader(paths, encode_idxs, prefetch=prefetch)
+    assert len(rfr) == 50
+    assert rfr.segment_offsets.tolist() == [0, 20, 20, 50]
+    assert rfr.segment_frame(19) == (0, 19)
+    assert rfr.segment_frame(20) == (2, 0)
+    with pytest.raises(IndexError):
+      rfr.segment_frame(50)
+
+    for fidx in [0, 19, 18, 20, 49, 3, 35]:
+      np.testing.assert_array_equal(rfr.get(fidx), expected[fidx])
+    np.testing.assert_array_equal(rfr.get_frame_id(41), expected[21])
+    np.testing.assert_array_equal(rfr.get_timestamp(46 * 50 - 1), expected[20 + 4])
+    with pytest.raises(KeyError):
+      rfr.get_frame_id(45)
+    with pytest.raises(KeyError):
+      rfr.get_timestamp(-1)
+
+    # only the current segment and the next one are kept open
+    rfr.get(19)
+    assert set(rfr._readers) <= {0, 2}
+    if prefetch:
+      assert 2 in rfr._readers
+    rfr.close()
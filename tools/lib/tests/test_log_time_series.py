@@ -0,0 +1,67 @@
+import os
+import tempfile
+import numpy as np
+
+from cereal import log as capnp_log
+from openpilot.tools.lib.log_time_series import load_time_series, save_time_series
+from openpilot.tools.lib.logreader import LogReader, save_log
+
+
+def assert_time_series_equal(a, b):
+  assert a.keys() == b.keys()
+  for service in a:
+    assert a[service].keys() == b[service].keys()
+    for name in a[service]:
+      x, y = a[service][name], b[service][name]
+      assert x.dtype == y.dtype
+      if x.dtype == object:
+        assert len(x) == len(y)
+        assert all(np.array_equal(u, v) for u, v in zip(x, y, strict=True))
+      else:
+        np.testing.assert_array_equal(x, y)
+
+
+class TestLogTimeSeries:
+  def test_round_trip(self):
+    values = {
+      "carState": {
+        "t": np.arange(3, dtype=np.float64),
+        "vEgo": np.array([1., 2., 3.], dtype=np.float32),
+        "cruiseState/speed": np.array([4., 5., 6.]),
+        "_valid": np.array([True, False, True]),
+      },
+      "radarState": {
+        "t": np.arange(2, dtype=np.float64),
+        # ragged lists are object arrays
+        "leads": np.array([np.array([1, 2]), np.array([3])], dtype=object),
+        "name": np.array(["a", "bc"]),
+      },
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = os.path.join(tmpdir, "ts")
+      save_time_series(values, path)
+      loaded = load_time_series(path)
+      assert_time_series_equal(values, loaded)
+
+      # loaded columns can be modified without changing the cache
+      loaded["carState"]["vEgo"][0] = 10.
+      assert load_time_series(path)["carState"]["vEgo"][0] == 1.
+
+      # already populated by another reader
+      save_time_series(values, path)
+      assert_time_series_equal(values, load_time_series(path))
+
+  def test_cache_opt_in(self, monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir, tempfile.NamedTemporaryFile(suffix=".zst") as log_file:
+      monkeypatch.setenv("COMMA_CACHE", tmpdir)
+      save_log(log_file.name, [capnp_log.Event.new_message(logMonoTime=int(i * 1e9), carState={"vEgo": i}).as_reader() for i in range(10)])
+
+      monkeypatch.delenv("FILEREADER_CACHE", raising=False)
+      ts = LogReader(log_file.name).time_series
+      assert not os.path.exists(os.path.join(tmpdir, "time_series"))
+
+      monkeypatch.setenv("FILEREADER_CACHE", "1")
+      cached = LogReader(log_file.name).time_series
+      assert os.path.isdir(os.path.join(tmpdir, "time_series"))
+      assert_time_series_equal(ts, cached)
+      assert_time_series_equal(ts, LogReader(log_file.name).time_series)
@@ -10,7 +10,10 @@ import requests
 from parameterized import parameterized
 
 from cereal import log as capnp_log
-from openpilot.tools.lib.logreader import LogsUnavailable, LogIterable, LogReader, comma_api_source, parse_indirect, ReadMode, InternalUnavailableException
+from openpilot.tools.lib.log_cache import DecompressedLogCache, get_log_cache
+from openpilot.tools.lib.log_index import LogIndex, index_path
+from openpilot.tools.lib.logreader import LogsUnavailable, LogIterable, LogReader, comma_api_source, parse_indirect, ReadMode, InternalUnavailableException, \
+  _LogFileReader, eval_source, save_log
 from openpilot.tools.lib.route import SegmentRange
 from openpilot.tools.lib.url_file import URLFileException
 
@@ -108,6 +111,14 @@ class TestLogReader:
     # file_exists should not be called for direct files
     assert file_exists_mock.call_count == 0
 
+  def test_eval_source(self, mocker):
+    existing = {"0/rlog.zst", "1/rlog.bz2", "1/rlog.zst", "3/rlog.zst"}
+    mocker.patch("openpilot.tools.lib.logreader.file_exists", side_effect=lambda fn: fn in existing)
+
+    files = [[f"{seg}/rlog.bz2", f"{seg}/rlog.zst"] for seg in range(4)]
+    assert eval_source(files) == ["0/rlog.zst", "1/rlog.bz2", None, "3/rlog.zst"]
+    assert eval_source(["2/rlog.zst", "3/rlog.zst"]) == [None, "3/rlog.zst"]
+
   @parameterized.expand([
     (f"{TEST_ROUTE}///",),
     (f"{TEST_ROUTE}---",),
@@ -254,3 +265,213 @@ class TestLogReader:
       msgs = list(LogReader(qlog.name, only_union_types=True))
       assert len(msgs) == num_msgs
       [m.which() for m in msgs]
+
+  @pytest.mark.parametrize("ext", ["", ".bz2", ".zst"])
+  def test_stream(self, ext):
+    with tempfile.NamedTemporaryFile(suffix=ext) as log_file:
+      msgs = [capnp_log.Event.new_message(logMonoTime=i, valid=True).as_reader() for i in range(10000)]
+      save_log(log_file.name, msgs)
+
+      lr = LogReader(log_file.name, stream=True)
+      assert [m.logMonoTime for m in lr] == [m.logMonoTime for m in LogReader(log_file.name)]
+      # iterating again decodes the file again
+      assert len(list(lr)) == len(msgs)
+
+      with pytest.raises(AssertionError):
+        list(LogReader(log_file.name, stream=True, sort_by_time=True))
+
+  def test_filter_index(self, mocker, monkeypatch, tmp_path):
+    monkeypatch.setenv("FILEREADER_CACHE", "1")
+    monkeypatch.setenv("COMMA_CACHE", str(tmp_path))
+    with tempfile.NamedTemporaryFile(suffix=".zst") as log_file:
+      services = ["carState", "controlsState", "carParams"]
+      msgs = []
+      # every event has a different body
+      for i in range(1000):
+        msgs.append(capnp_log.Event.new_message(logMonoTime=3 * i, carState={"vEgo": i}).as_reader())
+        msgs.append(capnp_log.Event.new_message(logMonoTime=3 * i + 1, controlsState={"curvature": i}).as_reader())
+        msgs.append(capnp_log.Event.new_message(logMonoTime=3 * i + 2, carParams={"carFingerprint": str(i)}).as_reader())
+      save_log(log_file.name, msgs)
+      build_spy = mocker.spy(_LogFileReader, "_read_and_index")
+
+      for _ in range(2):
+        for service in services:
+          indexed = [m.as_builder().to_bytes() for m in LogReader(log_file.name).filter(service)]
+          expected = [m.as_builder().to_bytes() for m in LogReader(log_file.name, use_index=False).filter(service)]
+          assert indexed == expected
+          assert len(indexed) == len(msgs) // len(services)
+        assert LogReader(log_file.name).first("liveCalibration") is None
+
+      # index is built on the first full read and reused afterwards
+      assert os.path.exists(index_path(log_file.name))
+      assert build_spy.call_count == 1
+
+  def test_filter_without_sidecar(self, mocker, monkeypatch):
+    monkeypatch.delenv("FILEREADER_CACHE", raising=False)
+    with tempfile.NamedTemporaryFile(suffix=".zst") as log_file:
+      save_log(log_file.name, [capnp_log.Event.new_message(logMonoTime=i, **{["carState", "carParams"][i % 2]: {}}).as_reader() for i in range(100)])
+      open_spy = mocker.spy(_LogFileReader, "_open")
+
+      lr = LogReader(log_file.name)
+      for _ in range(3):
+        assert lr.first("carParams") is not None
+        assert len(list(lr.filter("carState"))) == 50
+      # read once and kept, like when iterating
+      assert open_spy.call_count == 1
+
+  def test_index_sidecar(self, monkeypatch, tmp_path):
+    monkeypatch.setenv("COMMA_CACHE", str(tmp_path / "cache"))
+    fn = str(tmp_path / "rlog.zst")
+    save_log(fn, [capnp_log.Event.new_message(logMonoTime=i, carState={"vEgo": i}).as_reader() for i in range(100)])
+
+    # opt-in, nothing is written without FILEREADER_CACHE
+    monkeypatch.delenv("FILEREADER_CACHE", raising=False)
+    assert len(list(LogReader(fn).filter("carState"))) == 100
+    assert index_path(fn) is None
+    assert not (tmp_path / "cache").exists()
+
+    monkeypatch.setenv("FILEREADER_CACHE", "1")
+    assert len(list(LogReader(fn).filter("carState"))) == 100
+    assert LogIndex.load(index_path(fn)) is not None
+
+    # a truncated sidecar is removed and rebuilt
+    with open(index_path(fn), "r+b") as f:
+      f.truncate(100)
+    assert [m.vEgo for m in LogReader(fn).filter("carState")] == list(range(100))
+    assert len(LogIndex.load(index_path(fn))) == 100
+
+  @pytest.mark.parametrize("stream", [True, False])
+  def test_prefetch(self, stream):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      fns = []
+      for seg in range(5):
+        fns.append(os.path.join(tmpdir, f"{seg}.zst"))
+        save_log(fns[-1], [capnp_log.Event.new_message(logMonoTime=seg * 1000 + i).as_reader() for i in range(1000)])
+
+      msgs = [m.logMonoTime for m in LogReader(fns, stream=stream, prefetch=3)]
+      assert msgs == [m.logMonoTime for m in LogReader(fns)]
+      assert msgs == list(range(5000))
+
+  def test_select(self):
+    with tempfile.NamedTemporaryFile(suffix=".zst") as log_file:
+      msgs = []
+      for i in range(100):
+        msgs.append(capnp_log.Event.new_message(logMonoTime=int(i * 1e9), carState={"vEgo": i, "steeringAngleDeg": -i}).as_reader())
+        msgs.append(capnp_log.Event.new_message(logMonoTime=int(i * 1e9), controlsState={"curvature": i}).as_reader())
+      save_log(log_file.name, msgs)
+
+      records = LogReader(log_file.name).select({"carState": ["vEgo", "steeringAngleDeg"], "liveCalibration": ["rpyCalib"]})
+      assert set(records) == {"carState", "liveCalibration"}
+      assert len(records["liveCalibration"]) == 0
+      assert records["carState"].t.tolist() == list(range(100))
+      assert records["carState"].vEgo.tolist() == list(range(100))
+      assert records["carState"].steeringAngleDeg.tolist() == [-i for i in range(100)]
+
+  def test_select_nested(self):
+    with tempfile.NamedTemporaryFile(suffix=".zst") as log_file:
+      msgs = []
+      for i in range(10):
+        # out of order, records are sorted by time
+        t = int((9 - i) * 1e9)
+        msgs.append(capnp_log.Event.new_message(logMonoTime=t, carControl={"actuators": {"accel": 9 - i}}).as_reader())
+        msgs.append(capnp_log.Event.new_message(logMonoTime=t, liveCalibration={"rpyCalib": [0, 1, 9 - i]}).as_reader())
+        msgs.append(capnp_log.Event.new_message(logMonoTime=t, radarState={"leadOne": {"dRel": 9 - i}}).as_reader())
+      save_log(log_file.name, msgs)
+
+      records = LogReader(log_file.name).select({"carControl": ["actuators.accel"], "liveCalibration": ["rpyCalib"], "radarState": ["leadOne"]})
+      assert records["carControl"].t.tolist() == list(range(10))
+      assert records["carControl"]["actuators.accel"].tolist() == list(range(10))
+      # fixed size lists are sub-arrays
+      assert records["liveCalibration"].rpyCalib.shape == (10, 3)
+      assert records["liveCalibration"].rpyCalib[:, 2].tolist() == list(range(10))
+      # structs are dicts
+      assert [r["dRel"] for r in records["radarState"].leadOne] == list(range(10))
+
+  def test_time_window(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      fns = []
+      for seg in range(3):
+        fns.append(os.path.join(tmpdir, f"{seg}.zst"))
+        # one carState every 100ms, 60s per segment
+        save_log(fns[-1], [capnp_log.Event.new_message(logMonoTime=int((seg * 60 + i * 0.1) * 1e9), carState={}).as_reader() for i in range(600)])
+
+      msgs = list(LogReader(fns, start_time=55, end_time=65))
+      assert len(msgs) == 100
+      assert all(55e9 <= m.logMonoTime < 65e9 for m in msgs)
+
+      assert len(list(LogReader(fns, start_time=120).filter("carState"))) == 600
+      assert len(list(LogReader(fns, end_time=1).filter("carParams"))) == 0
+
+  def test_time_window_reads(self, mocker, monkeypatch, tmp_path):
+    monkeypatch.setenv("FILEREADER_CACHE", "1")
+    monkeypatch.setenv("COMMA_CACHE", str(tmp_path))
+    with tempfile.TemporaryDirectory() as tmpdir:
+      fns = []
+      for seg in range(10):
+        fns.append(os.path.join(tmpdir, f"{seg}.zst"))
+        save_log(fns[-1], [capnp_log.Event.new_message(logMonoTime=int((seg * 60 + i * 0.1) * 1e9), carState={}).as_reader() for i in range(600)])
+      read_spy = mocker.spy(_LogFileReader, "read_indexed")
+
+      # cold cache, only the first segment is read and indexed
+      assert len(list(LogReader(fns, start_time=0, end_time=10))) == 100
+      assert read_spy.call_count == 1
+      assert [os.path.exists(index_path(fn)) for fn in fns] == [True] + [False] * 9
+
+      read_spy.reset_mock()
+      assert len(list(LogReader(fns, start_time=65, end_time=70))) == 50
+      assert read_spy.call_count == 1
+
+      # cold cache, segments before the window are skipped by the first event of the next one
+      read_spy.reset_mock()
+      assert len(list(LogReader(fns, start_time=300, end_time=310))) == 100
+      assert [call.args[0]._fn for call in read_spy.call_args_list] == [fns[5]]
+      assert [os.path.exists(index_path(fn)) for fn in fns[:6]] == [True, True, False, False, False, True]
+
+  def test_log_cache(self, monkeypatch):
+    monkeypatch.setenv("LOG_CACHE", "1")
+    with tempfile.NamedTemporaryFile(suffix=".zst") as log_file:
+      save_log(log_file.name, [capnp_log.Event.new_message(logMonoTime=i).as_reader() for i in range(100)])
+      log_cache = get_log_cache()
+      hits, misses = log_cache.stats["hits"], log_cache.stats["misses"]
+
+      assert len(list(LogReader(log_file.name))) == 100
+      assert len(list(LogReader(log_file.name, stream=True))) == 100
+      assert log_cache.stats["misses"] == misses + 1
+      assert log_cache.stats["hits"] == hits + 1
+
+  def test_log_cache_failed_put(self):
+    with tempfile.TemporaryDirectory() as tmpdir, tempfile.NamedTemporaryFile(suffix=".zst") as log_file:
+      log_cache = DecompressedLogCache(tmpdir, max_bytes=1024)
+
+      def chunks():
+        yield capnp_log.Event.new_message(logMonoTime=0).to_bytes()
+        raise requests.ConnectionError
+
+      with pytest.raises(requests.ConnectionError):
+        log_cache.put(log_file.name, chunks())
+      # no tmp file is left behind
+      assert os.listdir(tmpdir) == []
+
+      # truncated logs aren't stored
+      assert log_cache.put(log_file.name, [capnp_log.Event.new_message(logMonoTime=0).to_bytes()[:-1]]) is None
+      assert os.listdir(tmpdir) == []
+
+  def test_log_cache_concurrent_eviction(self, mocker):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      log_cache = DecompressedLogCache(tmpdir, max_bytes=150)
+      for i in range(3):
+        with open(os.path.join(tmpdir, str(i)), "wb") as f:
+          f.write(b"\0" * 100)
+        os.utime(os.path.join(tmpdir, str(i)), (i, i))
+
+      # a file removed by another process between listing and stat
+      gone = mocker.MagicMock(path=os.path.join(tmpdir, "gone"), is_file=lambda: True)
+      gone.name = "gone"
+      gone.stat.side_effect = FileNotFoundError
+      scandir = os.scandir
+      mocker.patch("openpilot.tools.lib.log_cache.os.scandir", lambda path: [gone, *scandir(path)])
+
+      log_cache.evict(keep=os.path.join(tmpdir, "0"))
+      mocker.stopall()
+      assert sorted(os.listdir(tmpdir)) == ["0"]
+      assert log_cache.stats["evictions"] == 2
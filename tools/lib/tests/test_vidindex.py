@@ -0,0 +1,84 @@
+import contextlib
+import io
+import random
+import tempfile
+import pytest
+
+from openpilot.tools.lib.vidindex import HEVC_CODED_SLICE_SEGMENT_NAL_UNITS, HEVC_PARAMETER_SET_NAL_UNITS, HevcNalUnitType, VideoFileInvalid, \
+  get_hevc_nal_unit_length, get_hevc_nal_unit_type, get_hevc_slice_type, hevc_index, require_nal_unit_start
+
+NAL_UNIT_TYPES = [*HEVC_PARAMETER_SET_NAL_UNITS, HevcNalUnitType.IDR_W_RADL, HevcNalUnitType.CRA_NUT, HevcNalUnitType.TRAIL_R,
+                  HevcNalUnitType.TRAIL_N, HevcNalUnitType.PREFIX_SEI_NUT, HevcNalUnitType.AUD_NUT]
+
+
+def reference_hevc_index(dat: bytes, allow_corrupt: bool) -> tuple[list, int, bytes]:
+  # one NAL unit at a time, like hevc_index before it was batched
+  if len(dat) < 4:
+    raise VideoFileInvalid("data is too short")
+  if dat[0] != 0x00:
+    raise VideoFileInvalid("first byte must be 0x00")
+
+  prefix_dat = b""
+  frame_types = []
+  i = 1
+  try:
+    while i < len(dat):
+      require_nal_unit_start(dat, i)
+      nal_unit_len = get_hevc_nal_unit_length(dat, i)
+      nal_unit_type = get_hevc_nal_unit_type(dat, i)
+      if nal_unit_type in HEVC_PARAMETER_SET_NAL_UNITS:
+        prefix_dat += dat[i:i+nal_unit_len]
+      elif nal_unit_type in HEVC_CODED_SLICE_SEGMENT_NAL_UNITS:
+        slice_type, is_first_slice = get_hevc_slice_type(dat, i, nal_unit_type)
+        if is_first_slice:
+          frame_types.append((slice_type, i))
+      i += nal_unit_len
+  except Exception:
+    if not allow_corrupt:
+      raise
+  return frame_types, len(dat), prefix_dat
+
+
+def random_hevc(rng: random.Random) -> bytes:
+  dat = bytearray(b"\x00")
+  num_nal_units = rng.randint(0, 12)
+  for k in range(num_nal_units):
+    nal_unit_type = rng.choice(NAL_UNIT_TYPES)
+    dat += b"\x00\x00\x01" + bytes([nal_unit_type << 1, 1])
+    # mostly first slices, small bytes make long exp-golomb codes which can run past the end of the data
+    payload_len = rng.randint(0, 1) if k == num_nal_units - 1 and rng.random() < 0.5 else rng.randint(0, 5)
+    payload = bytes([rng.choice([0x80 | rng.randrange(128), rng.randrange(256)])] +
+                    [rng.choice([0, rng.randrange(16), rng.randrange(256)]) for _ in range(payload_len)])
+    dat += payload.replace(b"\x00\x00", b"\x00\x03")
+
+  # cut short or corrupt some streams
+  if len(dat) > 1 and rng.random() < 0.3:
+    dat = dat[:rng.randint(1, len(dat))]
+  if len(dat) > 1 and rng.random() < 0.1:
+    dat[rng.randrange(1, len(dat))] = rng.randrange(256)
+  return bytes(dat)
+
+
+def index(dat: bytes, func, allow_corrupt: bool):
+  with tempfile.NamedTemporaryFile() as f, contextlib.redirect_stdout(io.StringIO()):
+    f.write(dat)
+    f.flush()
+    try:
+      return func(f.name if func is hevc_index else dat, allow_corrupt)
+    except Exception as e:
+      return type(e)
+
+
+class TestVidIndex:
+  @pytest.mark.parametrize("allow_corrupt", [False, True])
+  def test_matches_reference(self, allow_corrupt):
+    rng = random.Random(0)
+    for _ in range(10000):
+      dat = random_hevc(rng)
+      assert index(dat, hevc_index, allow_corrupt) == index(dat, reference_hevc_index, allow_corrupt), dat.hex()
+
+  def test_truncated_slice(self):
+    # the slice header ends before slice_type
+    dat = bytes.fromhex("0000000110018101")
+    assert index(dat, hevc_index, False) is VideoFileInvalid
+    assert index(dat, hevc_index, True) == ([], len(dat), b"")
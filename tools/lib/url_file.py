@@ -2,16 +2,19 @@ import logging
 import os
 import socket
 import time
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha256
 from urllib3 import PoolManager, Retry
 from urllib3.response import BaseHTTPResponse
 from urllib3.util import Timeout
 
-from openpilot.common.file_helpers import atomic_write_in_dir
+from openpilot.common.download_cache import get_download_cache
 from openpilot.system.hardware.hw import Paths
 #  Cache chunk size
 K = 1000
 CHUNK_SIZE = 1000 * K
+#  Max concurrent chunk downloads for reads spanning multiple chunks
+PARALLEL_DOWNLOADS = 8
 
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
@@ -72,50 +75,75 @@ class URLFile:
     if self._length is not None:
       return self._length
 
-    file_length_path = os.path.join(Paths.download_cache_root(), hash_256(self._url) + "_length")
-    if not self._force_download and os.path.exists(file_length_path):
-      with open(file_length_path) as file_length:
-        content = file_length.read()
+    length_key = hash_256(self._url) + "_length"
+    if not self._force_download:
+      content = get_download_cache().get(length_key)
+      if content is not None:
         self._length = int(content)
         return self._length
 
     self._length = self.get_length_online()
     if not self._force_download and self._length != -1:
-      with atomic_write_in_dir(file_length_path, mode="w", overwrite=True) as file_length:
-        file_length.write(str(self._length))
+      get_download_cache().put(length_key, str(self._length).encode())
     return self._length
 
   def read(self, ll: int|None=None) -> bytes:
     if self._force_download:
       return self.read_aux(ll=ll)
+    return bytes(self.read_view(ll))
 
-    file_begin = self._pos
-    file_end = self._pos + ll if ll is not None else self.get_length()
-    assert file_end != -1, f"Remote file is empty or doesn't exist: {self._url}"
-    #  We have to align with chunks we store. Position is the begginiing of the latest chunk that starts before or at our file
-    position = (file_begin // CHUNK_SIZE) * CHUNK_SIZE
-    response = b""
-    while True:
-      self._pos = position
-      chunk_number = self._pos / CHUNK_SIZE
-      file_name = hash_256(self._url) + "_" + str(chunk_number)
-      full_path = os.path.join(Paths.download_cache_root(), str(file_name))
-      data = None
-      #  If we don't have a file, download it
-      if not os.path.exists(full_path):
-        data = self.read_aux(ll=CHUNK_SIZE)
-        with atomic_write_in_dir(full_path, mode="wb", overwrite=True) as new_cached_file:
-          new_cached_file.write(data)
-      else:
-        with open(full_path, "rb") as cached_file:
-          data = cached_file.read()
+  def read_view(self, ll: int|None=None) -> memoryview:
+    """Like read, but returns a view of a single preallocated buffer instead of a copy of it."""
+    if self._force_download:
+      return memoryview(self.read_aux(ll=ll))
+
+    length = self.get_length()
+    assert length != -1, f"Remote file is empty or doesn't exist: {self._url}"
+    buf = bytearray(max(0, (min(self._pos + ll, length) if ll is not None else length) - self._pos))
+    self.readinto(buf)
+    return memoryview(buf)
 
-      response += data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)]
+  def readinto(self, buf) -> int:
+    if self._force_download:
+      data = self.read_aux(ll=len(buf))
+      memoryview(buf)[:len(data)] = data
+      return len(data)
 
-      position += CHUNK_SIZE
-      if position >= file_end:
-        self._pos = file_end
-        return response
+    length = self.get_length()
+    assert length != -1, f"Remote file is empty or doesn't exist: {self._url}"
+    out = memoryview(buf).cast('B')
+    file_begin = self._pos
+    file_end = min(self._pos + len(out), length)
+    #  We have to align with chunks we store. Position is the begginiing of the latest chunk that starts before or at our file
+    positions = range((file_begin // CHUNK_SIZE) * CHUNK_SIZE, file_end, CHUNK_SIZE)
+
+    def read_chunk(position: int) -> None:
+      begin, end = max(file_begin, position), min(file_end, position + CHUNK_SIZE)
+      self._read_chunk_into(position, length, begin - position, out[begin - file_begin:end - file_begin])
+
+    if len(positions) > 1:
+      with ThreadPoolExecutor(max_workers=min(PARALLEL_DOWNLOADS, len(positions))) as pool:
+        list(pool.map(read_chunk, positions))
+    else:
+      for position in positions:
+        read_chunk(position)
+
+    self._pos = max(file_begin, file_end)
+    return max(0, file_end - file_begin)
+
+  def _read_chunk_into(self, position: int, length: int, offset: int, out: memoryview) -> None:
+    chunk_number = position / CHUNK_SIZE
+    key = hash_256(self._url) + "_" + str(chunk_number)
+    n = get_download_cache().readinto(key, out, offset)
+    if n is None:
+      #  If we don't have a chunk, download it
+      data = self._download({'Range': f"bytes={position}-{min(position + CHUNK_SIZE, length) - 1}"}, download_range=True)
+      get_download_cache().put(key, data)
+      n = max(0, min(len(out), len(data) - offset))
+      out[:n] = memoryview(data)[offset:offset + n]
+
+    if n != len(out):
+      raise URLFileException(f"Error, chunk {chunk_number} is shorter than expected ({self._url})")
 
   def read_aux(self, ll: int|None=None) -> bytes:
     download_range = False
@@ -130,6 +158,11 @@ class URLFile:
       headers['Range'] = f"bytes={self._pos}-{end}"
       download_range = True
 
+    ret = self._download(headers, download_range)
+    self._pos += len(ret)
+    return ret
+
+  def _download(self, headers: dict[str, str], download_range: bool) -> bytes:
     if self._debug:
       t1 = time.monotonic()
 
@@ -148,8 +181,6 @@ class URLFile:
       raise URLFileException(f"Error, requested range but got unexpected response {response_code} {headers} ({self._url}): {repr(ret)[:500]}")
     if (not download_range) and response_code != 200:  # OK
       raise URLFileException(f"Error {response_code} {headers} ({self._url}): {repr(ret)[:500]}")
-
-    self._pos += len(ret)
     return ret
 
   def seek(self, pos:int) -> None:
@@ -4,7 +4,9 @@ import os
 import struct
 from enum import IntEnum
 
-from openpilot.tools.lib.filereader import FileReader
+import numpy as np
+
+from openpilot.tools.lib.filereader import FileReader, read_buffer
 
 DEBUG = int(os.getenv("DEBUG", "0"))
 
@@ -258,9 +260,40 @@ def get_hevc_slice_type(dat: bytes, nal_unit_start: int, nal_unit_type: HevcNalU
     raise VideoFileInvalid("slice_type must be 0, 1, or 2")
   return slice_type, is_first_slice
 
+def get_hevc_nal_unit_starts(buf: np.ndarray) -> np.ndarray:
+  # start codes can't overlap, every match is the start of a NAL unit
+  ones = np.flatnonzero(buf[NAL_UNIT_START_CODE_SIZE - 1:] == 1)
+  starts: np.ndarray = ones[(buf[ones] == 0) & (buf[ones + 1] == 0)]
+  return starts
+
+def get_bit_length(v: np.ndarray) -> np.ndarray:
+  # exact for values up to 2**53
+  return np.frexp(v.astype(np.float64))[1]
+
+def get_hevc_first_slice_types(buf: np.ndarray, rbsp_starts: np.ndarray, skip_bits: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+  """Batched get_hevc_slice_type for first slice segments, returns slice types and whether they could be read
+  from the first 32 bits of the slice segment header."""
+  # first 32 bits of each header, bytes past the end read as zero
+  idx = rbsp_starts[:, None] + np.arange(4)
+  b = np.where(idx < len(buf), buf[np.minimum(idx, len(buf) - 1)], 0).astype(np.uint64)
+  window = (b[:, 0] << 24) | (b[:, 1] << 16) | (b[:, 2] << 8) | b[:, 3]
+
+  # slice_pic_parameter_set_id ue(v), then slice_type ue(v)
+  pps_id_bits = (window << skip_bits.astype(np.uint64)) & 0xFFFFFFFF
+  pps_id_size = 2 * (32 - get_bit_length(pps_id_bits)) + 1
+  slice_type_start = skip_bits + pps_id_size
+  slice_type_bits = (window << np.minimum(slice_type_start, 32).astype(np.uint64)) & 0xFFFFFFFF
+  slice_type_size = 2 * (32 - get_bit_length(slice_type_bits)) + 1
+  slice_types = (slice_type_bits >> (32 - np.minimum(slice_type_size, 32)).astype(np.uint64)).astype(np.int64) - 1
+
+  # the zero bits read past the end of the data don't count, get_ue raises there
+  end_bits = slice_type_start + slice_type_size
+  valid = (pps_id_bits != 0) & (slice_type_bits != 0) & (end_bits <= 32) & (end_bits <= 8 * (len(buf) - rbsp_starts)) & (slice_types <= 2)
+  return slice_types, valid
+
 def hevc_index(hevc_file_name: str, allow_corrupt: bool=False) -> tuple[list, int, bytes]:
   with FileReader(hevc_file_name) as f:
-    dat = f.read()
+    dat = read_buffer(f)
 
   if len(dat) < NAL_UNIT_START_CODE_SIZE + 1:
     raise VideoFileInvalid("data is too short")
@@ -268,28 +301,57 @@ def hevc_index(hevc_file_name: str, allow_corrupt: bool=False) -> tuple[list, in
   if dat[0] != 0x00:
     raise VideoFileInvalid("first byte must be 0x00")
 
-  prefix_dat = b""
+  buf = np.frombuffer(dat, dtype=np.uint8)
   frame_types = list()
+  prefix_dat = bytearray()
 
   i = 1 # skip past first byte 0x00
   try:
-    while i < len(dat):
-      require_nal_unit_start(dat, i)
-      nal_unit_len = get_hevc_nal_unit_length(dat, i)
-      nal_unit_type = get_hevc_nal_unit_type(dat, i)
-      if nal_unit_type in HEVC_PARAMETER_SET_NAL_UNITS:
-        prefix_dat += dat[i:i+nal_unit_len]
-      elif nal_unit_type in HEVC_CODED_SLICE_SEGMENT_NAL_UNITS:
-        slice_type, is_first_slice = get_hevc_slice_type(dat, i, nal_unit_type)
-        if is_first_slice:
-          frame_types.append((slice_type, i))
-      i += nal_unit_len
+    require_nal_unit_start(dat, i)
+    starts = get_hevc_nal_unit_starts(buf)
+    starts = starts[starts >= i]
+    rbsp_starts = starts + NAL_UNIT_START_CODE_SIZE + NAL_UNIT_HEADER_SIZE
+
+    # only the last NAL unit can be cut short, everything before is followed by a start code
+    has_header = rbsp_starts <= len(buf)
+    nal_unit_types = (buf[np.minimum(starts + NAL_UNIT_START_CODE_SIZE, len(buf) - 1)] >> 1) & 0x3F
+    is_slice = np.isin(nal_unit_types, HEVC_CODED_SLICE_SEGMENT_NAL_UNITS) & has_header
+    is_first_slice = is_slice & (rbsp_starts < len(buf)) & (buf[np.minimum(rbsp_starts, len(buf) - 1)] >> 7 == 1)
+    first_slices = np.flatnonzero(is_first_slice)
+
+    # skip first_slice_segment_in_pic_flag and no_output_of_prior_pics_flag
+    is_irap = (nal_unit_types[first_slices] >= HevcNalUnitType.BLA_W_LP) & (nal_unit_types[first_slices] <= HevcNalUnitType.RSV_IRAP_VCL23)
+    slice_types, valid = get_hevc_first_slice_types(buf, rbsp_starts[first_slices], 1 + is_irap)
+    slice_types = slice_types.tolist()
+
+    # anything the batched parse couldn't handle goes through the per NAL unit path, in file order, which raises on invalid data
+    irregular = set(first_slices[~valid].tolist()) | set(np.flatnonzero(~has_header | (is_slice & (rbsp_starts >= len(buf)))).tolist())
+    end = len(starts)
+    for k in sorted(irregular):
+      i = int(starts[k])
+      try:
+        nal_unit_type = get_hevc_nal_unit_type(dat, i)
+        if nal_unit_type in HEVC_CODED_SLICE_SEGMENT_NAL_UNITS:
+          slice_type, _ = get_hevc_slice_type(dat, i, nal_unit_type)
+          slice_types[np.searchsorted(first_slices, k)] = slice_type
+      except Exception:
+        end = k
+        break
+
+    for k in np.flatnonzero(np.isin(nal_unit_types[:end], HEVC_PARAMETER_SET_NAL_UNITS) & has_header[:end]).tolist():
+      prefix_dat += memoryview(dat)[starts[k]:starts[k + 1] if k + 1 < len(starts) else len(dat)]
+    frame_types = list(zip(slice_types[:np.searchsorted(first_slices, end)], starts[first_slices[first_slices < end]].tolist(), strict=True))
+
+    if end < len(starts):
+      # re-raise the error of the first invalid NAL unit
+      i = int(starts[end])
+      get_hevc_slice_type(dat, i, get_hevc_nal_unit_type(dat, i))
   except Exception as e:
     if not allow_corrupt:
       raise
     print(f"ERROR: NAL unit skipped @ {i}\n", str(e))
 
-  return frame_types, len(dat), prefix_dat
+  return frame_types, len(dat), bytes(prefix_dat)
 
 def main() -> None:
   parser = argparse.ArgumentParser()
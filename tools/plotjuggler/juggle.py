@@ -15,7 +15,7 @@ from openpilot.common.basedir import BASEDIR
 from openpilot.common.swaglog import cloudlog
 from openpilot.tools.cabana.dbc.generate_dbc_json import generate_dbc_dict
 from openpilot.tools.lib.logreader import LogReader, ReadMode, save_log
-from openpilot.selfdrive.test.process_replay.migration import migrate_all
+from openpilot.selfdrive.test.process_replay.migration import get_migrations, migrate_iter
 
 juggle_dir = os.path.dirname(os.path.realpath(__file__))
 
@@ -86,7 +86,8 @@ def juggle_route(route_or_segment_name, can, layout, dbc, should_migrate):
 
   all_data = lr.run_across_segments(24, partial(process, can))
   if should_migrate:
-    all_data = migrate_all(all_data)
+    # migrated while saving, without a second copy of the route
+    all_data = migrate_iter(all_data, get_migrations())
 
   # Infer DBC name from logs
   platform = None